@@ -1,4 +1,16 @@
-from dmi_instascraper.app import InstagramScraperApp
+import multiprocessing
+import sys
 
-app = InstagramScraperApp(0)
-app.MainLoop()
+# needed for shards running in worker processes in the frozen executable
+multiprocessing.freeze_support()
+
+# without arguments (or with only the process serial number macOS may pass
+# when launching the app bundle) the GUI is started; with arguments, the
+# command line interface is used
+if [argument for argument in sys.argv[1:] if not argument.startswith("-psn")]:
+    from dmi_instascraper.cli import main
+    sys.exit(main())
+else:
+    from dmi_instascraper.app import InstagramScraperApp
+    app = InstagramScraperApp(0)
+    app.MainLoop()
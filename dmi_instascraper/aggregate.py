@@ -0,0 +1,129 @@
+import itertools
+import collections
+
+from dmi_instascraper.export import write_csv
+from xml.sax.saxutils import quoteattr
+
+
+class TagAggregator:
+    """
+    Hashtag and mention aggregator
+
+    Counts hashtags and mentions, and how often hashtags occur together, while
+    items are scraped. Only the counts are kept, so memory use depends on the
+    amount of distinct tags rather than the amount of items. At the end, the
+    counts can be written as summary tables and as a hashtag co-occurrence
+    network.
+    """
+    def __init__(self):
+        """
+        Instantiate aggregator
+        """
+        self.items = 0
+        self.hashtags = collections.Counter()
+        self.mentions = collections.Counter()
+        self.cooccurrences = collections.Counter()
+
+    def add(self, item):
+        """
+        Count the hashtags and mentions in an item
+
+        Tags are counted once per item, and case-insensitively.
+
+        :param dict item:  Item, with comma-separated `hashtags` and
+        `mentioned` columns
+        """
+        self.items += 1
+        hashtags = sorted({tag.lower() for tag in str(item.get("hashtags", "")).split(",") if tag})
+        mentions = {user.lower() for user in str(item.get("mentioned", "")).split(",") if user}
+
+        self.hashtags.update(hashtags)
+        self.mentions.update(mentions)
+        self.cooccurrences.update(itertools.combinations(hashtags, 2))
+
+    def write(self, folder, stem):
+        """
+        Write summary tables and network files
+
+        Written are CSV files with hashtag counts, mention counts and hashtag
+        pair counts, and the hashtag co-occurrence network as GEXF (e.g. for
+        Gephi) and GDF files.
+
+        :param Path folder:  Folder to write files to
+        :param str stem:  Base file name
+        :return list:  Paths of the files that were written
+        """
+        hashtags_path = folder.joinpath(stem + "-hashtags.csv")
+        mentions_path = folder.joinpath(stem + "-mentions.csv")
+        pairs_path = folder.joinpath(stem + "-hashtag-pairs.csv")
+        gexf_path = folder.joinpath(stem + "-hashtags.gexf")
+        gdf_path = folder.joinpath(stem + "-hashtags.gdf")
+
+        write_csv(hashtags_path, ({"hashtag": tag, "count": count} for tag, count in self.hashtags.most_common()),
+                  ["hashtag", "count"])
+        write_csv(mentions_path, ({"mention": user, "count": count} for user, count in self.mentions.most_common()),
+                  ["mention", "count"])
+        write_csv(pairs_path, ({"hashtag_1": pair[0], "hashtag_2": pair[1], "count": count}
+                               for pair, count in self.cooccurrences.most_common()), ["hashtag_1", "hashtag_2", "count"])
+        self.write_gexf(gexf_path)
+        self.write_gdf(gdf_path)
+
+        return [hashtags_path, mentions_path, pairs_path, gexf_path, gdf_path]
+
+    def node_ids(self):
+        """
+        Get node IDs for the hashtag network
+
+        :return dict:  Node IDs, keyed by hashtag
+        """
+        return {tag: "n%i" % index for index, tag in enumerate(self.hashtags)}
+
+    def write_gexf(self, path):
+        """
+        Write the hashtag co-occurrence network as a GEXF file
+
+        Nodes are hashtags, with their count as attribute; edges connect
+        hashtags that occur in the same item, weighted by how often they do.
+
+        :param Path path:  Path to write file to
+        """
+        ids = self.node_ids()
+        with path.open("w", encoding="utf-8") as output:
+            output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            output.write('<gexf xmlns="http://gexf.net/1.3" version="1.3">\n')
+            output.write('  <meta>\n    <creator>DMI Instagram Scraper</creator>\n  </meta>\n')
+            output.write('  <graph mode="static" defaultedgetype="undirected">\n')
+            output.write('    <attributes class="node">\n')
+            output.write('      <attribute id="count" title="count" type="integer"/>\n')
+            output.write('    </attributes>\n')
+
+            output.write('    <nodes>\n')
+            for tag, count in self.hashtags.items():
+                output.write('      <node id="%s" label=%s>\n' % (ids[tag], quoteattr(tag)))
+                output.write('        <attvalues><attvalue for="count" value="%i"/></attvalues>\n' % count)
+                output.write('      </node>\n')
+            output.write('    </nodes>\n')
+
+            output.write('    <edges>\n')
+            for index, (pair, count) in enumerate(self.cooccurrences.items()):
+                output.write('      <edge id="%i" source="%s" target="%s" weight="%i"/>\n' % (
+                    index, ids[pair[0]], ids[pair[1]], count))
+            output.write('    </edges>\n')
+
+            output.write('  </graph>\n</gexf>\n')
+
+    def write_gdf(self, path):
+        """
+        Write the hashtag co-occurrence network as a GDF file
+
+        :param Path path:  Path to write file to
+        """
+        ids = self.node_ids()
+        with path.open("w", encoding="utf-8") as output:
+            output.write("nodedef>name VARCHAR,label VARCHAR,count INTEGER\n")
+            for tag, count in self.hashtags.items():
+                output.write("%s,'%s',%i\n" % (ids[tag], tag.replace("'", "\\'"), count))
+
+            output.write("edgedef>node1 VARCHAR,node2 VARCHAR,weight DOUBLE\n")
+            for pair, count in self.cooccurrences.items():
+                output.write("%s,%s,%i\n" % (ids[pair[0]], ids[pair[1]], count))
@@ -1,21 +1,19 @@
 import packaging.version
 import webbrowser
 import requests
+import sqlite3
 import sys
-import csv
 import wx
 import re
 import os
 
 from dmi_instascraper.instagram_scraper import InstagramScraper
+from dmi_instascraper.status_log import StatusLog
+from dmi_instascraper.export import write_csv
+from dmi_instascraper.dataset import Dataset
+from dmi_instascraper.session import default_session_path
 from pathlib import Path
 
-# this seems to be compatible... mostly
-# at least it also imports properly into Google Sheets
-csv.register_dialect("excel-compat", delimiter=",", doublequote=True, escapechar="\\", lineterminator="\n",
-                     quotechar='"', quoting=csv.QUOTE_ALL, skipinitialspace=False, strict=False)
-
-
 # helper function to get correct path to resources also when running as the
 # one-file executable
 def resource(relative_path):
@@ -53,9 +51,10 @@ class InstascraperFrame(wx.Frame):
 
         # dimensions
         WIDTH = 480
-        HEIGHT = 789
+        HEIGHT = 849
         SIZE = (WIDTH, HEIGHT)
         WIDTH_LABEL = 100
+        WIDTH_FORMAT = 120
         MARGIN = 10
 
         # everything else is derived from those
@@ -127,13 +126,23 @@ class InstascraperFrame(wx.Frame):
         query_wrap.Add(self.query_input, flag=wx.EXPAND)
 
         # Amount of items
-        # this number of items is scraped per query
-        self.amount_input = wx.TextCtrl(self.main_panel, wx.ID_ANY, "50", size=(WIDTH_CONTROL, -1))
+        # this number of items is scraped per query - unless a budget is set,
+        # in which case as many items as the budget allows are scraped, with
+        # this as the maximum per query
+        self.amount_input = wx.TextCtrl(self.main_panel, wx.ID_ANY, "50", size=(80, -1))
+        self.budget_choice = wx.Choice(self.main_panel, wx.ID_ANY, choices=["No budget", "Minutes", "Requests"],
+                                       size=(110, -1))
+        self.budget_choice.SetSelection(0)
+        self.budget_input = wx.TextCtrl(self.main_panel, wx.ID_ANY, "", size=(60, -1))
         amount_wrap = wx.BoxSizer(wx.HORIZONTAL)
         amount_wrap.Add(
             wx.StaticText(self.main_panel, wx.ID_ANY, "Items per query", size=(WIDTH_LABEL, -1), style=wx.ALIGN_RIGHT),
             flag=wx.RIGHT, border=MARGIN)
         amount_wrap.Add(self.amount_input)
+        amount_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "Budget"), flag=wx.LEFT | wx.RIGHT | wx.CENTER,
+                        border=MARGIN // 2)
+        amount_wrap.Add(self.budget_choice)
+        amount_wrap.Add(self.budget_input, flag=wx.LEFT, border=MARGIN)
 
         # Toggle comments scrape
         # if set, comments are also scraped, but this takes much longer
@@ -151,14 +160,45 @@ class InstascraperFrame(wx.Frame):
         comments_wrap.Add(self.metadata_checkbox, flag=wx.LEFT, border=10)
         comments_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "Metadata files"))
 
+        # Raw data archive and hashtag summary
+        # if set, the raw data for each item is saved too, so the results can
+        # later be rebuilt with other columns without scraping again; and/or
+        # hashtags and mentions are counted while scraping
+        self.archive_checkbox = wx.CheckBox(self.main_panel)
+        self.tags_checkbox = wx.CheckBox(self.main_panel)
+        archive_wrap = wx.BoxSizer(wx.HORIZONTAL)
+        archive_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "", size=(WIDTH_LABEL, -1)), flag=wx.RIGHT,
+                         border=MARGIN)
+        archive_wrap.Add(self.archive_checkbox)
+        archive_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "Raw data archive"))
+        archive_wrap.Add(self.tags_checkbox, flag=wx.LEFT, border=10)
+        archive_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "Hashtag summary and network"))
+
+        # Profiling
+        # if set, the scrape is profiled and a report is saved next to the
+        # results, to help figure out why a scrape is slow
+        self.profile_checkbox = wx.CheckBox(self.main_panel)
+        debug_wrap = wx.BoxSizer(wx.HORIZONTAL)
+        debug_wrap.Add(
+            wx.StaticText(self.main_panel, wx.ID_ANY, "Debugging", size=(WIDTH_LABEL, -1), style=wx.ALIGN_RIGHT),
+            flag=wx.RIGHT, border=MARGIN)
+        debug_wrap.Add(self.profile_checkbox)
+        debug_wrap.Add(wx.StaticText(self.main_panel, wx.ID_ANY, "Save performance profile"))
+
         # File name
-        # the results are saved as a CSV file here
-        self.file_input = wx.TextCtrl(self.main_panel, wx.ID_ANY, "instagram-scrape.csv", size=(WIDTH_CONTROL, -1))
+        # the results are saved as a CSV file here, or added to an SQLite
+        # dataset with the same name
+        self.file_input = wx.TextCtrl(self.main_panel, wx.ID_ANY, "instagram-scrape.csv",
+                                      size=(WIDTH_CONTROL - WIDTH_FORMAT - MARGIN, -1))
+        self.format_choice = wx.Choice(self.main_panel, wx.ID_ANY, choices=["CSV file", "SQLite dataset"],
+                                       size=(WIDTH_FORMAT, -1))
+        self.format_choice.SetSelection(0)
         file_wrap = wx.BoxSizer(wx.HORIZONTAL)
         file_wrap.Add(
             wx.StaticText(self.main_panel, wx.ID_ANY, "File name", size=(WIDTH_LABEL, -1), style=wx.ALIGN_RIGHT),
             flag=wx.RIGHT, border=MARGIN)
         file_wrap.Add(self.file_input)
+        file_wrap.Add(self.format_choice, flag=wx.LEFT, border=MARGIN)
 
         # Target folder
         # the folder where the results file is saved
@@ -187,14 +227,12 @@ class InstascraperFrame(wx.Frame):
         progress_wrap.Add(self.progress_bar, wx.EXPAND)
 
         # Logger
-        # a simple text field that cannot be written in, to which new
-        # lines are added
-        self.logger = wx.TextCtrl(self.main_panel, wx.ID_ANY, "",
-                                  style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_RICH | wx.BORDER_NONE,
-                                  size=(WIDTH_CONTROL, 90))
-        self.logger.SetDefaultStyle(wx.TextAttr(wx.SystemSettings.GetColour(wx.SYS_COLOUR_GRAYTEXT), frame_background))
+        # a read-only list of the most recent messages; older messages are
+        # dropped from view but kept in the log file while scraping
+        self.logger = StatusLog(self.main_panel, size=(WIDTH_CONTROL, 90))
+        self.logger.SetTextColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_GRAYTEXT))
         self.logger.SetBackgroundColour(frame_background)
-        self.logger.AppendText("Waiting for input...")
+        self.logger.log("Waiting for input...")
         status_wrap = wx.BoxSizer(wx.HORIZONTAL)
         status_wrap.Add(
             wx.StaticText(self.main_panel, wx.ID_ANY, "Status", size=(WIDTH_LABEL, -1), style=wx.ALIGN_RIGHT),
@@ -203,8 +241,8 @@ class InstascraperFrame(wx.Frame):
 
         # this is the order in which items are added to the window
         order = (
-            logo_wrap, intro_wrap, query_wrap, amount_wrap, comments_wrap, file_wrap, folder_wrap, scrape_button_wrap,
-            progress_wrap, status_wrap)
+            logo_wrap, intro_wrap, query_wrap, amount_wrap, comments_wrap, archive_wrap, debug_wrap, file_wrap,
+            folder_wrap, scrape_button_wrap, progress_wrap, status_wrap)
 
         # organise items in window
         # some items are centered, and some items get a horizontal row below
@@ -302,8 +340,9 @@ class InstascraperFrame(wx.Frame):
         :param event:  Event that triggered the method
         """
         togglable_controls = (
-            self.amount_input, self.query_input, self.file_input, self.folder_input, self.comments_checkbox,
-            self.photos_checkbox)
+            self.amount_input, self.budget_choice, self.budget_input, self.query_input, self.file_input, self.format_choice, self.folder_input,
+            self.comments_checkbox,
+            self.photos_checkbox, self.archive_checkbox, self.tags_checkbox, self.profile_checkbox)
 
         if not self.scraping:
             # no scrape running - disable all controls, make progress bar pulse
@@ -312,7 +351,15 @@ class InstascraperFrame(wx.Frame):
                 control.Disable()
             self.scraping = True
             self.scrape_button.SetLabel("Stop scraping")
+
+            # keep a full log of the scrape next to the results file, since
+            # the status log in the window only shows the most recent messages
+            log_path = Path(self.folder_input.GetPath()).joinpath(Path(self.file_input.GetValue()).stem + ".log")
+            log_opened = self.logger.start_log_file(log_path)
             self.logMessage("Scrape started")
+            if not log_opened:
+                self.logMessage("Could not create log file %s, continuing without it." % log_path.name)
+
             self.progress_bar.Enable()
             self.progress_bar.Pulse()
             self.startScrape()
@@ -342,13 +389,17 @@ class InstascraperFrame(wx.Frame):
             self.progress_bar.Disable()
             self.scrape_button.SetLabel("Start scraping")
 
+            # messages the scraper sent while stopping are still queued as
+            # events, so only close the log file once those have been logged
+            wx.CallAfter(self.logger.stop_log_file, self.logger.log_file)
+
     def logMessage(self, message):
         """
         Add a message to the status log at the bottom of the window
 
         :param message: Message to log
         """
-        self.logger.AppendText("\n" + message)
+        self.logger.log(message)
 
     def handleScraperEvent(self, message):
         """
@@ -374,17 +425,17 @@ class InstascraperFrame(wx.Frame):
                 self.scrapeControl(None)
                 return
 
+            if self.format_choice.GetSelection() == 1:
+                self.saveToDataset(data, self.scraper.result_queries)
+                self.scrapeControl(None)
+                return
+
             # write CSV file
             path = Path(self.folder_input.GetPath()).joinpath(self.file_input.GetValue())
-            fieldnames = list(data[0].keys())
 
             self.logMessage("Writing results to file...")
             try:
-                with path.open("w", encoding="utf-8") as output:
-                    writer = csv.DictWriter(output, fieldnames=fieldnames, dialect="excel-compat")
-                    writer.writeheader()
-                    for post in data:
-                        writer.writerow(post)
+                write_csv(path, data)
 
                 self.logMessage("Done! Results written to %s" % self.file_input.GetValue())
             except (FileNotFoundError, FileExistsError, PermissionError):
@@ -406,6 +457,27 @@ class InstascraperFrame(wx.Frame):
             else:
                 self.progress_bar.SetValue(data["value"])
 
+    def saveToDataset(self, data, queries):
+        """
+        Add scraped items to the SQLite dataset
+
+        The dataset has the same name as the file name in the form, but with
+        an .sqlite extension. Items already in the dataset are updated.
+
+        :param list data:  Scraped items
+        :param dict queries:  Queries per thread ID
+        """
+        path = Path(self.folder_input.GetPath()).joinpath(Path(self.file_input.GetValue()).stem + ".sqlite")
+
+        self.logMessage("Adding results to dataset...")
+        try:
+            dataset = Dataset(path)
+            new, updated = dataset.upsert(data, queries)
+            dataset.close()
+            self.logMessage("Done! %i new and %i updated items in %s" % (new, updated, path.name))
+        except sqlite3.Error as e:
+            self.logMessage("Could not write to dataset %s (%s)" % (path.name, e))
+
     def startScrape(self):
         """
         Start scraping Instagram
@@ -417,6 +489,9 @@ class InstascraperFrame(wx.Frame):
         scrape_comments = self.comments_checkbox.GetValue()
         scrape_files = self.photos_checkbox.GetValue()
         scrape_metadata = self.metadata_checkbox.GetValue()
+        scrape_profile = self.profile_checkbox.GetValue()
+        scrape_archive = self.archive_checkbox.GetValue()
+        scrape_tags = self.tags_checkbox.GetValue()
         scrape_target = Path(self.folder_input.GetPath())
         scrape_filename = self.file_input.GetValue()
 
@@ -433,8 +508,31 @@ class InstascraperFrame(wx.Frame):
             self.amount_input.SetValue(50)
             max_posts = 50
 
+        # the budget is divided across all queries
+        time_budget = 0
+        request_budget = 0
+        if self.budget_choice.GetSelection() > 0:
+            # minutes can be fractional, but requests cannot
+            minutes = self.budget_choice.GetSelection() == 1
+            try:
+                budget = float(self.budget_input.GetValue()) if minutes else int(self.budget_input.GetValue())
+            except ValueError:
+                budget = 0
+
+            if budget <= 0:
+                self.logMessage("Enter a budget larger than 0 (a whole number of requests), or choose 'No budget'.")
+                self.scrapeControl(None)
+                return
+
+            if minutes:
+                time_budget = budget * 60
+            else:
+                request_budget = budget
+
         self.scraper = InstagramScraper(self.scrape_event_id, self, queries, max_posts, scrape_comments, scrape_files,
-                                        scrape_metadata, scrape_target, scrape_filename)
+                                        scrape_metadata, scrape_target, scrape_filename, scrape_profile,
+                                        scrape_archive, time_budget=time_budget, request_budget=request_budget,
+                                        scrape_tags=scrape_tags, session_file=default_session_path())
         self.scraper.start()
 
 
@@ -0,0 +1,380 @@
+import datetime
+import json
+import gzip
+import zlib
+import re
+
+from dmi_instascraper.export import DEFAULT_COLUMNS
+
+# hashtags and mentions in comments and captions; used both when scraping and
+# when rebuilding, so rebuilt datasets match scraped ones
+hashtag = re.compile(r"#([^\s,.+=-]+)")
+mention = re.compile(r"@([a-zA-Z0-9_]+)")
+
+# instaloader's own hashtag regex, used for post captions
+caption_hashtag = re.compile(r"(?:#)(\w(?:(?:\w|(?:\.(?!\.))){0,28}(?:\w))?)")
+
+# records are compressed in batches of this many, each batch a complete gzip
+# member, so a scrape that is killed loses at most the last batch
+ARCHIVE_BATCH = 100
+
+# every gzip member starts with these bytes
+GZIP_MAGIC = b"\x1f\x8b\x08"
+
+
+def utc_timestamp(date):
+    """
+    Get the Unix timestamp of a UTC date as returned by instaloader
+
+    instaloader's `date_utc` and `created_at_utc` are naive datetimes, which
+    `timestamp()` would interpret as local time.
+
+    :param datetime.datetime date:  Naive UTC date
+    :return int:  Unix timestamp
+    """
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+class ArchiveWriter:
+    """
+    Raw data archive
+
+    Stores the raw data Instagram returned for each scraped post and comment
+    as gzipped newline-delimited JSON. Datasets can later be rebuilt from the
+    archive with a different set of columns, without scraping again.
+
+    Records are written in batches, each compressed as a separate gzip
+    member. The file is still a regular gzip file, but if the scraper is
+    killed while writing, only the last batch is damaged, and `read_archive()`
+    can skip it.
+    """
+    def __init__(self, path, batch_size=ARCHIVE_BATCH):
+        """
+        Open archive for writing
+
+        If the archive already exists, new records are appended to it.
+
+        :param Path path:  Path to archive file
+        :param int batch_size:  Amount of records per gzip member
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.file = path.open("ab")
+
+    def add_post(self, post, query):
+        """
+        Add a post to the archive
+
+        This should be called after the post's metadata has been used, because
+        instaloader only includes the metadata it has retrieved so far.
+
+        :param instaloader.Post post:  Post to archive
+        :param str query:  Query the post was scraped for
+        """
+        self.write({
+            "type": "post",
+            "query": query,
+            "thread_id": post.shortcode,
+            "parent_id": post.shortcode,
+            "node": post._asdict()
+        })
+
+    def add_comment(self, comment, query, thread_id, parent_id, num_answers=0):
+        """
+        Add a comment or reply to the archive
+
+        instaloader does not keep the raw comment data around, so a node is
+        reconstructed in the same format Instagram uses.
+
+        :param comment:  instaloader.PostComment or PostCommentAnswer
+        :param str query:  Query the post was scraped for
+        :param str thread_id:  Shortcode of the post the comment is on
+        :param parent_id:  ID of the post or comment this is a reply to
+        :param int num_answers:  Amount of replies to the comment
+        """
+        self.write({
+            "type": "comment",
+            "query": query,
+            "thread_id": thread_id,
+            "parent_id": parent_id,
+            "node": {
+                "id": comment.id,
+                "created_at": utc_timestamp(comment.created_at_utc),
+                "text": comment.text,
+                "owner": comment.owner._asdict(),
+                "edge_liked_by": {"count": comment.likes_count if hasattr(comment, "likes_count") else 0},
+                "edge_threaded_comments": {"count": num_answers}
+            }
+        })
+
+    def write(self, record):
+        """
+        Write a record to the archive
+
+        :param dict record:  Record to write
+        """
+        self.batch.append(json.dumps(record) + "\n")
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the current batch of records to the file as one gzip member
+        """
+        if self.batch:
+            self.file.write(gzip.compress("".join(self.batch).encode("utf-8")))
+            self.file.flush()
+            self.batch = []
+
+    def close(self):
+        """
+        Close the archive
+        """
+        self.flush()
+        self.file.close()
+
+
+def _find_member(infile, offset, chunk_size=1024 * 1024):
+    """
+    Find the start of the next gzip member in a file
+
+    :param infile:  File, opened in binary mode
+    :param int offset:  Position to start looking from
+    :param int chunk_size:  Bytes to read at a time
+    :return int:  Position of the next member, or `None` if there is none
+    """
+    infile.seek(offset)
+    overlap = b""
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            return None
+
+        data = overlap + chunk
+        position = data.find(GZIP_MAGIC)
+        if position >= 0:
+            return offset - len(overlap) + position
+
+        offset += len(chunk)
+        overlap = data[-(len(GZIP_MAGIC) - 1):]
+
+
+def _read_lines(infile, log=None, chunk_size=1024 * 1024):
+    """
+    Iterate through the lines in a gzip file that may be damaged
+
+    Damaged members, e.g. one that was being written when the scraper was
+    killed, are skipped: lines read from it so far are kept, and reading
+    continues with the next intact member.
+
+    :param infile:  File, opened in binary mode
+    :param log:  Function to call with a warning if data had to be skipped
+    :param int chunk_size:  Bytes to read at a time
+    :return:  Generator yielding lines, as bytes
+    """
+    offset = 0
+    while True:
+        infile.seek(offset)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b""
+        try:
+            while not decompressor.eof:
+                chunk = infile.read(chunk_size)
+                if not chunk:
+                    if offset == infile.tell():
+                        # end of file, after the last member
+                        return
+                    raise EOFError("Compressed file ended before the end-of-stream marker")
+
+                lines = (pending + decompressor.decompress(chunk)).split(b"\n")
+                pending = lines.pop()
+                yield from lines
+
+            if pending:
+                yield pending
+
+            # the next member starts right after this one
+            offset = infile.tell() - len(decompressor.unused_data)
+
+        except (EOFError, zlib.error) as e:
+            # the incomplete line at the point of damage cannot be trusted,
+            # so it is dropped
+            next_member = _find_member(infile, offset + 1)
+            if log:
+                log("Archive is damaged at byte %i (%s); %s" % (
+                    offset, e, "skipping to the next intact part" if next_member is not None else
+                    "records after this point are lost"))
+
+            if next_member is None:
+                return
+
+            offset = next_member
+
+
+def read_archive(path, log=None):
+    """
+    Iterate through the records in an archive
+
+    Damaged parts of the archive are skipped, see `_read_lines()`.
+
+    :param Path path:  Path to archive file
+    :param log:  Function to call with warnings about damaged parts
+    :return:  Generator yielding records
+    """
+    with path.open("rb") as infile:
+        for line in _read_lines(infile, log):
+            if not line.strip():
+                continue
+
+            try:
+                yield json.loads(line.decode("utf-8"))
+            except ValueError:
+                if log:
+                    log("Skipping unreadable record in archive")
+
+
+def _record_key(record):
+    """
+    Get the key identifying the item an archive record is about
+
+    :param dict record:  Archive record
+    :return tuple:  Record type and item ID
+    """
+    return record["type"], record["thread_id"] if record["type"] == "post" else record["node"]["id"]
+
+
+def _caption(node):
+    """
+    Get caption of a post node
+
+    :param dict node:  Post node
+    :return str:  Caption, or an empty string if there is none
+    """
+    if node.get("edge_media_to_caption", {}).get("edges"):
+        return node["edge_media_to_caption"]["edges"][0]["node"]["text"]
+
+    return node.get("caption") or ""
+
+
+def _body(record):
+    return _caption(record["node"]) if record["type"] == "post" else record["node"]["text"]
+
+
+def _count(node, *fields):
+    """
+    Get the first available count from a list of edge fields
+
+    :param dict node:  Node
+    :param fields:  Edge field names to try
+    :return int:  Count, or 0 if none of the fields are available
+    """
+    for field in fields:
+        if field in node and "count" in node[field]:
+            return node[field]["count"]
+
+    return 0
+
+
+def _children(node):
+    return [edge["node"] for edge in node.get("edge_sidecar_to_children", {}).get("edges", [])]
+
+
+def _post_type(record):
+    if record["type"] != "post":
+        return "comment"
+
+    return "video" if record["node"].get("is_video") else "picture"
+
+
+def _display_url(node):
+    return node.get("display_url", node.get("display_src", ""))
+
+
+# columns that can be rebuilt from the archive
+# each is a function that takes an archive record and returns the value for
+# that column; post-only columns are empty for comments
+COLUMNS = {
+    "id": lambda record: record["thread_id"] if record["type"] == "post" else record["node"]["id"],
+    "thread_id": lambda record: record["thread_id"],
+    "parent_id": lambda record: record["parent_id"],
+    "body": _body,
+    "author": lambda record: record["node"].get("owner", {}).get("username", ""),
+    "timestamp": lambda record: record["node"].get("taken_at_timestamp", record["node"].get("date"))
+                                if record["type"] == "post" else record["node"]["created_at"],
+    "type": _post_type,
+    "url": lambda record: (record["node"].get("video_url", "") if record["node"].get("is_video")
+                           else _display_url(record["node"])) if record["type"] == "post" else "",
+    "thumbnail_url": lambda record: _display_url(record["node"]) if record["type"] == "post" else "",
+    "hashtags": lambda record: ",".join(caption_hashtag.findall(_body(record).lower()) if record["type"] == "post"
+                                        else hashtag.findall(_body(record))),
+    "usertags": lambda record: ",".join([edge["node"]["user"]["username"].lower() for edge in
+                                         record["node"].get("edge_media_to_tagged_user", {}).get("edges", [])]),
+    "mentioned": lambda record: ",".join(mention.findall(_body(record))),
+    "num_likes": lambda record: _count(record["node"], "edge_media_preview_like", "edge_liked_by"),
+    "num_comments": lambda record: _count(record["node"], "edge_media_to_comment", "edge_media_to_parent_comment",
+                                          "edge_threaded_comments"),
+    "subject": lambda record: "",
+    "query": lambda record: record["query"],
+    "author_id": lambda record: record["node"].get("owner", {}).get("id", ""),
+    "location": lambda record: (record["node"].get("location") or {}).get("name", ""),
+    "location_id": lambda record: (record["node"].get("location") or {}).get("id", ""),
+    "product_type": lambda record: record["node"].get("product_type", ""),
+    "typename": lambda record: record["node"].get("__typename", ""),
+    "accessibility_caption": lambda record: record["node"].get("accessibility_caption") or "",
+    "num_views": lambda record: record["node"].get("video_view_count") or "",
+    "num_children": lambda record: len(_children(record["node"])),
+    "children_urls": lambda record: ",".join([child.get("video_url", "") if child.get("is_video")
+                                              else _display_url(child) for child in _children(record["node"])]),
+    "children_types": lambda record: ",".join(["video" if child.get("is_video") else "picture"
+                                               for child in _children(record["node"])]),
+}
+
+
+def rebuild(path, columns=None, log=None):
+    """
+    Rebuild a dataset from an archive
+
+    No data is retrieved from Instagram; everything is derived from the
+    archived records. An archive may contain the same post or comment more
+    than once, if it was scraped in several runs; only the most recently
+    archived version is included. For this the archive is read twice, so
+    only the item IDs need to fit in memory.
+
+    :param Path path:  Path to archive file
+    :param list columns:  Columns to include, see `COLUMNS`; by default the
+    same columns as a regular scrape
+    :param log:  Function to call with warnings about damaged parts of the
+    archive
+    :return:  Generator yielding one dictionary per post or comment
+    """
+    if not columns:
+        columns = DEFAULT_COLUMNS
+
+    # checked here rather than in the generator, so unknown columns are
+    # reported before anything is written
+    unknown = [column for column in columns if column not in COLUMNS]
+    if unknown:
+        raise ValueError("Unknown column(s): %s" % ", ".join(unknown))
+
+    extractors = [(column, COLUMNS[column]) for column in columns]
+
+    def items():
+        latest = {}
+        for index, record in enumerate(read_archive(path)):
+            latest[_record_key(record)] = index
+
+        for index, record in enumerate(read_archive(path, log)):
+            if latest[_record_key(record)] != index:
+                continue
+
+            item = {}
+            for column, extractor in extractors:
+                try:
+                    item[column] = extractor(record)
+                except (KeyError, IndexError, TypeError):
+                    item[column] = ""
+
+            yield item
+
+    return items()
@@ -0,0 +1,164 @@
+import time
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised when the scrape has to stop because the budget has run out
+    """
+    pass
+
+
+class Budget:
+    """
+    Scrape budget
+
+    Limits a scrape by wall-clock time, by the amount of requests made to
+    Instagram, or both. The scrape stops when either runs out.
+    """
+    def __init__(self, seconds=0, requests=0):
+        """
+        Start budget
+
+        The clock starts running when the budget is created.
+
+        :param float seconds:  Time budget in seconds, 0 for no time limit
+        :param int requests:  Request budget, 0 for no request limit
+        """
+        self.seconds = seconds
+        self.requests = requests
+        self.started_at = time.time()
+        self.requests_made = 0
+        self.ran_out = False
+
+    def count_request(self):
+        """
+        Register a request to Instagram
+        """
+        self.requests_made += 1
+
+    def seconds_left(self):
+        """
+        Get the time left in the budget
+
+        :return float:  Seconds left, or `None` if there is no time budget
+        """
+        if not self.seconds:
+            return None
+
+        return max(0.0, self.seconds - (time.time() - self.started_at))
+
+    def run_out(self):
+        """
+        Consider the budget used up, e.g. because Instagram asked to wait for
+        longer than there is time left
+        """
+        self.ran_out = True
+
+    def used(self):
+        """
+        Get the fraction of the budget that has been used
+
+        If there is both a time and a request budget, the one that is closest
+        to running out counts.
+
+        :return float:  Fraction between 0 and 1
+        """
+        if self.ran_out:
+            return 1.0
+
+        used = 0
+        if self.seconds:
+            used = max(used, (time.time() - self.started_at) / self.seconds)
+
+        if self.requests:
+            used = max(used, self.requests_made / self.requests)
+
+        return min(used, 1.0)
+
+    def exhausted(self):
+        """
+        Check if the budget has run out
+
+        :return bool:  Whether the budget has run out
+        """
+        return self.used() >= 1.0
+
+
+class BudgetScheduler:
+    """
+    Divides a budget across queries
+
+    Each turn, the query that has so far cost the least of the budget gets to
+    fetch its next post. Queries whose feed runs dry drop out, so their share
+    goes to the remaining queries; queries that are slow or throttled cost
+    more per post, so other queries get their turn first. This way every
+    query gets as much coverage as the budget allows, instead of the first
+    queries using it all.
+    """
+    def __init__(self, queries, budget, max_posts=0):
+        """
+        Instantiate scheduler
+
+        :param list queries:  Queries to divide the budget across
+        :param Budget budget:  Budget to divide
+        :param int max_posts:  Maximum amount of posts per query, 0 for no
+        maximum
+        """
+        self.budget = budget
+        self.max_posts = max_posts
+        self.active = list(dict.fromkeys(queries))
+        self.spent = {query: 0.0 for query in self.active}
+        self.posts = {query: 0 for query in self.active}
+
+    def cost(self, seconds, requests):
+        """
+        Express time and requests as a share of the budget
+
+        :param float seconds:  Time spent
+        :param int requests:  Requests made
+        :return float:  Share of the budget
+        """
+        cost = 0.0
+        if self.budget.seconds:
+            cost += seconds / self.budget.seconds
+
+        if self.budget.requests:
+            cost += requests / self.budget.requests
+
+        return cost
+
+    def next_query(self):
+        """
+        Get the query that should fetch a post next
+
+        :return str:  Query, or `None` if the budget has run out or no query
+        has posts left
+        """
+        if not self.active or self.budget.exhausted():
+            return None
+
+        return min(self.active, key=lambda query: (self.spent[query], self.posts[query]))
+
+    def charge(self, query, seconds, requests, posts=0):
+        """
+        Register the cost of fetching posts for a query
+
+        :param str query:  Query
+        :param float seconds:  Time spent
+        :param int requests:  Requests made
+        :param int posts:  Posts fetched
+        """
+        self.spent[query] += self.cost(seconds, requests)
+        self.posts[query] += posts
+
+        if self.max_posts and self.posts[query] >= self.max_posts:
+            self.retire(query)
+
+    def retire(self, query):
+        """
+        Stop fetching posts for a query
+
+        :param str query:  Query
+        """
+        if query in self.active:
+            self.active.remove(query)
@@ -0,0 +1,422 @@
+import multiprocessing
+import argparse
+import datetime
+import sqlite3
+import sys
+
+from dmi_instascraper.archive import COLUMNS, rebuild
+from dmi_instascraper.export import DEFAULT_COLUMNS, read_csv, write_items
+from dmi_instascraper.aggregate import TagAggregator
+from dmi_instascraper.dataset import Dataset
+from pathlib import Path
+
+
+def command_rebuild(args):
+    """
+    Rebuild a dataset from a raw data archive
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    if args.list_columns:
+        for column in COLUMNS:
+            print(column)
+        return 0
+
+    if not args.archive or not args.output:
+        print("An archive and output file are required.", file=sys.stderr)
+        return 1
+
+    columns = [column.strip() for column in args.columns.split(",")] if args.columns else DEFAULT_COLUMNS
+    try:
+        items = rebuild(Path(args.archive), columns, log=lambda message: print(message, file=sys.stderr))
+    except ValueError as e:
+        print("%s. Use --list-columns to see which are available." % e, file=sys.stderr)
+        return 1
+
+    try:
+        rows = write_items(Path(args.output), items, columns)
+    except OSError as e:
+        print("Could not rebuild dataset: %s" % e, file=sys.stderr)
+        return 1
+
+    print("%i items written to %s" % (rows, args.output))
+    return 0
+
+
+def parse_time(value):
+    """
+    Parse a date or timestamp given on the command line
+
+    :param str value:  Unix timestamp, or date as YYYY-MM-DD (UTC)
+    :return int:  Unix timestamp
+    """
+    if value.isdigit():
+        return int(value)
+
+    try:
+        date = datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not a timestamp or YYYY-MM-DD date" % value)
+
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def command_export(args):
+    """
+    Export (part of) an SQLite dataset to a CSV or NDJSON file
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    if not Path(args.dataset).exists():
+        print("Dataset %s does not exist." % args.dataset, file=sys.stderr)
+        return 1
+
+    try:
+        dataset = Dataset(Path(args.dataset))
+        items = dataset.select(query=args.query, author=args.author, thread_id=args.thread, since=args.since,
+                               until=args.until)
+        rows = write_items(Path(args.output), items, DEFAULT_COLUMNS)
+        dataset.close()
+    except (sqlite3.Error, FileNotFoundError, PermissionError) as e:
+        print("Could not export dataset: %s" % e, file=sys.stderr)
+        return 1
+
+    print("%i items written to %s" % (rows, args.output))
+    return 0
+
+
+def command_queue_add(args):
+    """
+    Add jobs to a job queue
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.jobs import JobQueue
+
+    queries = read_queries(args)
+    if not queries:
+        print("No queries given.", file=sys.stderr)
+        return 1
+
+    options = read_options(args)
+    queue = JobQueue(Path(args.queue))
+    for query in queries:
+        queue.add(query, args.priority, options)
+    queue.close()
+
+    print("%i job(s) added to %s" % (len(queries), args.queue))
+    return 0
+
+
+def command_queue_status(args):
+    """
+    Show the jobs in a job queue
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.jobs import JobQueue
+
+    queue = JobQueue(Path(args.queue))
+    if args.jobs:
+        for job in queue.jobs(args.state):
+            throughput = ""
+            if job["state"] == "done":
+                throughput = "%i items in %.1fs (%.2f/s)" % (job["items"], job["duration"],
+                                                            job["items"] / max(job["duration"], 0.001))
+            elif job["error"]:
+                throughput = job["error"]
+
+            print("%6i  %-8s %4i  %-30s %s" % (job["id"], job["state"], job["priority"], job["query"], throughput))
+
+    print(", ".join(["%i %s" % (amount, state) for state, amount in queue.counts().items()]))
+    queue.close()
+    return 0
+
+
+def command_queue_retry(args):
+    """
+    Queue failed jobs again
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.jobs import JobQueue
+
+    queue = JobQueue(Path(args.queue))
+    print("%i failed job(s) queued again" % queue.retry_failed())
+    queue.close()
+    return 0
+
+
+def command_queue_run(args):
+    """
+    Work through a job queue
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.jobs import JobQueue, JobRunner
+    from dmi_instascraper.session import default_session_path
+
+    session_file = Path(args.session) if args.session else default_session_path()
+    queue = JobQueue(Path(args.queue), max_attempts=args.max_attempts)
+    runner = JobRunner(queue, Path(args.dataset), session_file=session_file)
+    try:
+        jobs_run = runner.run(wait=args.wait)
+        print("Queue empty, %i job(s) run" % jobs_run)
+    except KeyboardInterrupt:
+        print("Stopped; the interrupted job will be run again next time")
+    finally:
+        queue.close()
+
+    return 0
+
+
+def read_queries(args):
+    """
+    Get queries from the command line and/or a file with one query per line
+
+    :param args:  Parsed command line arguments, with `queries` and `file`
+    :return list:  Queries
+    """
+    queries = list(args.queries)
+    if args.file:
+        with open(args.file, encoding="utf-8") as infile:
+            queries += [line.strip() for line in infile if line.strip()]
+
+    return queries
+
+
+def read_options(args):
+    """
+    Get scrape options from the command line
+
+    :param args:  Parsed command line arguments
+    :return dict:  Scrape options, see `jobs.JOB_OPTIONS`
+    """
+    return {
+        "max_posts": args.max_posts,
+        "scrape_comments": args.comments,
+        "scrape_files": args.files,
+        "scrape_metadata": args.metadata,
+        "scrape_archive": args.archive,
+        "time_budget": args.time_budget * 60,
+        "request_budget": args.request_budget
+    }
+
+
+def add_option_arguments(parser):
+    """
+    Add arguments for scrape options to a parser
+
+    :param parser:  Argument parser
+    """
+    parser.add_argument("--max-posts", type=int, default=50, help="Posts to scrape per query")
+    parser.add_argument("--comments", action="store_true", help="Also scrape comments")
+    parser.add_argument("--files", action="store_true", help="Also save photo files")
+    parser.add_argument("--metadata", action="store_true", help="Also save metadata files")
+    parser.add_argument("--archive", action="store_true", help="Also save raw data to an archive")
+    parser.add_argument("--time-budget", type=float, default=0, help="Scrape for at most this many minutes, "
+                        "divided across queries; --max-posts is then the maximum per query (0 for no maximum)")
+    parser.add_argument("--request-budget", type=int, default=0, help="Make at most this many requests, divided "
+                        "across queries; --max-posts is then the maximum per query (0 for no maximum)")
+
+
+def command_shard_split(args):
+    """
+    Split queries into shards
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.shards import create_shards
+
+    queries = read_queries(args)
+    if not queries:
+        print("No queries given.", file=sys.stderr)
+        return 1
+
+    folder = Path(args.folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for manifest in create_shards(queries, args.shards, folder, read_options(args), args.name):
+        print(manifest)
+
+    return 0
+
+
+def command_shard_run(args):
+    """
+    Run one or more shards on this machine
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.shards import run_local
+
+    failed = 0
+    for path, stats, error in run_local([Path(manifest) for manifest in args.manifests], args.processes):
+        if error:
+            print("%s: failed (%s)" % (path.name, error), file=sys.stderr)
+            failed += 1
+        else:
+            print("%s: %i items in %.1f seconds, %i failed queries" % (
+                path.name, stats["items"], stats["duration"], len(stats["failed_queries"])))
+
+    return 1 if failed else 0
+
+
+def command_merge(args):
+    """
+    Merge shard results into one file
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    from dmi_instascraper.shards import merge
+
+    try:
+        stats = merge([Path(path) for path in args.inputs], Path(args.output))
+    except (FileNotFoundError, PermissionError, KeyError) as e:
+        print("Could not merge: %s" % e, file=sys.stderr)
+        return 1
+
+    print("%i items written to %s (%i posts, %i comments, %i duplicates removed)" % (
+        stats["items"], args.output, stats["posts"], stats["comments"], stats["duplicates"]))
+    if stats["failed_queries"]:
+        print("Failed queries: %s" % ", ".join(stats["failed_queries"]))
+
+    return 0
+
+
+def command_tags(args):
+    """
+    Write hashtag and mention summaries for a results file
+
+    :param args:  Parsed command line arguments
+    :return int:  Exit code
+    """
+    path = Path(args.input)
+    folder = Path(args.folder) if args.folder else path.parent
+    aggregator = TagAggregator()
+
+    try:
+        for item in read_csv(path):
+            aggregator.add(item)
+        files = aggregator.write(folder, path.stem)
+    except (FileNotFoundError, PermissionError) as e:
+        print("Could not summarise hashtags: %s" % e, file=sys.stderr)
+        return 1
+
+    print("%i items, %i distinct hashtags, %i distinct mentions" % (
+        aggregator.items, len(aggregator.hashtags), len(aggregator.mentions)))
+    for file in files:
+        print(file)
+
+    return 0
+
+
+def main(argv=None):
+    """
+    Run the command line interface
+
+    :param list argv:  Arguments; by default, those the program was called
+    with
+    :return int:  Exit code
+    """
+    parser = argparse.ArgumentParser(prog="dmi_instascraper",
+                                     description="DMI Instagram Scraper. Run without arguments to start the GUI.")
+    commands = parser.add_subparsers(dest="command")
+
+    rebuild_parser = commands.add_parser("rebuild", help="Rebuild a dataset from a raw data archive, without "
+                                                         "connecting to Instagram")
+    rebuild_parser.add_argument("archive", nargs="?", help="Archive file (.archive.ndjson.gz)")
+    rebuild_parser.add_argument("output", nargs="?", help="File to write, .csv or .ndjson")
+    rebuild_parser.add_argument("--columns", help="Comma-separated list of columns to include")
+    rebuild_parser.add_argument("--list-columns", action="store_true", help="List available columns and exit")
+    rebuild_parser.set_defaults(function=command_rebuild)
+
+    export_parser = commands.add_parser("export", help="Export (part of) an SQLite dataset to a file that can be "
+                                                       "imported into 4CAT")
+    export_parser.add_argument("dataset", help="Dataset file (.sqlite)")
+    export_parser.add_argument("output", help="File to write, .csv or .ndjson")
+    export_parser.add_argument("--query", help="Only items scraped for this query, without # or @")
+    export_parser.add_argument("--author", help="Only items by this author")
+    export_parser.add_argument("--thread", help="Only items in this thread (post shortcode)")
+    export_parser.add_argument("--since", type=parse_time, help="Only items posted on or after this date or "
+                                                                "timestamp")
+    export_parser.add_argument("--until", type=parse_time, help="Only items posted before this date or timestamp")
+    export_parser.set_defaults(function=command_export)
+
+    queue_parser = commands.add_parser("queue", help="Manage and run a persistent queue of scrape jobs")
+    queue_commands = queue_parser.add_subparsers(dest="queue_command")
+    queue_commands.required = True
+
+    queue_add_parser = queue_commands.add_parser("add", help="Add queries to the queue")
+    queue_add_parser.add_argument("queue", help="Job queue file (.sqlite), created if it does not exist")
+    queue_add_parser.add_argument("queries", nargs="*", help="Queries, #hashtags or @users")
+    queue_add_parser.add_argument("--file", help="File with one query per line")
+    queue_add_parser.add_argument("--priority", type=int, default=0, help="Jobs with higher priority run first")
+    add_option_arguments(queue_add_parser)
+    queue_add_parser.set_defaults(function=command_queue_add)
+
+    queue_status_parser = queue_commands.add_parser("status", help="Show the state of the queue")
+    queue_status_parser.add_argument("queue", help="Job queue file (.sqlite)")
+    queue_status_parser.add_argument("--jobs", action="store_true", help="List individual jobs and their throughput")
+    queue_status_parser.add_argument("--state", choices=("pending", "running", "done", "failed"),
+                                     help="Only list jobs with this state")
+    queue_status_parser.set_defaults(function=command_queue_status)
+
+    queue_retry_parser = queue_commands.add_parser("retry", help="Queue failed jobs again")
+    queue_retry_parser.add_argument("queue", help="Job queue file (.sqlite)")
+    queue_retry_parser.set_defaults(function=command_queue_retry)
+
+    queue_run_parser = queue_commands.add_parser("run", help="Run jobs until the queue is empty")
+    queue_run_parser.add_argument("queue", help="Job queue file (.sqlite)")
+    queue_run_parser.add_argument("dataset", help="SQLite dataset to add results to")
+    queue_run_parser.add_argument("--wait", action="store_true", help="Keep running and wait for new jobs")
+    queue_run_parser.add_argument("--max-attempts", type=int, default=3, help="Attempts before a job is failed")
+    queue_run_parser.add_argument("--session", help="File to keep the Instagram session in between runs; by "
+                                                    "default the same file as the GUI")
+    queue_run_parser.set_defaults(function=command_queue_run)
+
+    shard_parser = commands.add_parser("shard", help="Split queries into shards and run them in separate processes "
+                                                     "or on separate machines")
+    shard_commands = shard_parser.add_subparsers(dest="shard_command")
+    shard_commands.required = True
+
+    shard_split_parser = shard_commands.add_parser("split", help="Split queries into shard manifests")
+    shard_split_parser.add_argument("folder", help="Folder to write manifests to")
+    shard_split_parser.add_argument("queries", nargs="*", help="Queries, #hashtags or @users")
+    shard_split_parser.add_argument("--file", help="File with one query per line")
+    shard_split_parser.add_argument("--shards", type=int, required=True, help="Amount of shards")
+    shard_split_parser.add_argument("--name", default="shard", help="Base name for manifest and output files")
+    add_option_arguments(shard_split_parser)
+    shard_split_parser.set_defaults(function=command_shard_split)
+
+    shard_run_parser = shard_commands.add_parser("run", help="Run shards; results are saved next to each manifest")
+    shard_run_parser.add_argument("manifests", nargs="+", help="Shard manifest(s) (.manifest.json)")
+    shard_run_parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                                  help="Maximum amount of shards to run at the same time")
+    shard_run_parser.set_defaults(function=command_shard_run)
+
+    merge_parser = commands.add_parser("merge", help="Merge shard results into one file, removing duplicates")
+    merge_parser.add_argument("output", help="File to write, .csv or .ndjson")
+    merge_parser.add_argument("inputs", nargs="+", help="Shard result files (.csv)")
+    merge_parser.set_defaults(function=command_merge)
+
+    tags_parser = commands.add_parser("tags", help="Count hashtags and mentions in a results file and write summary "
+                                                   "tables and a hashtag co-occurrence network")
+    tags_parser.add_argument("input", help="Results file (.csv)")
+    tags_parser.add_argument("--folder", help="Folder to write files to; by default, the folder of the input file")
+    tags_parser.set_defaults(function=command_tags)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    return args.function(args)
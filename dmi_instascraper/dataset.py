@@ -0,0 +1,188 @@
+import sqlite3
+import time
+
+from dmi_instascraper.export import DEFAULT_COLUMNS
+
+# columns stored per item; the file columns are only filled if photo or
+# metadata files were saved
+FILE_COLUMNS = ["photo_file", "metadata_file"]
+ITEM_COLUMNS = DEFAULT_COLUMNS + FILE_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    parent_id TEXT,
+    body TEXT,
+    author TEXT,
+    timestamp INTEGER,
+    type TEXT,
+    url TEXT,
+    thumbnail_url TEXT,
+    hashtags TEXT,
+    usertags TEXT,
+    mentioned TEXT,
+    num_likes INTEGER,
+    num_comments INTEGER,
+    subject TEXT,
+    photo_file TEXT,
+    metadata_file TEXT,
+    first_seen INTEGER,
+    last_seen INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS item_queries (
+    id TEXT,
+    query TEXT,
+    PRIMARY KEY (id, query)
+);
+
+CREATE TABLE IF NOT EXISTS counter_history (
+    id TEXT,
+    seen_at INTEGER,
+    num_likes INTEGER,
+    num_comments INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS items_thread_id ON items (thread_id);
+CREATE INDEX IF NOT EXISTS items_author ON items (author);
+CREATE INDEX IF NOT EXISTS items_timestamp ON items (timestamp);
+CREATE INDEX IF NOT EXISTS item_queries_query ON item_queries (query);
+CREATE INDEX IF NOT EXISTS counter_history_id ON counter_history (id, seen_at);
+
+CREATE TRIGGER IF NOT EXISTS items_counters_new AFTER INSERT ON items
+BEGIN
+    INSERT INTO counter_history (id, seen_at, num_likes, num_comments)
+    VALUES (new.id, new.last_seen, new.num_likes, new.num_comments);
+END;
+
+CREATE TRIGGER IF NOT EXISTS items_counters_changed AFTER UPDATE OF num_likes, num_comments ON items
+WHEN old.num_likes IS NOT new.num_likes OR old.num_comments IS NOT new.num_comments
+BEGIN
+    INSERT INTO counter_history (id, seen_at, num_likes, num_comments)
+    VALUES (new.id, new.last_seen, new.num_likes, new.num_comments);
+END;
+"""
+
+
+class Dataset:
+    """
+    SQLite dataset
+
+    Collects the results of several scrapes in one SQLite database. Items are
+    keyed by their ID, so scraping the same post again updates it rather than
+    adding a duplicate. Every time the like or comment count of an item
+    changes, the new counts are added to its history.
+    """
+    def __init__(self, path):
+        """
+        Open dataset, creating it if it does not exist yet
+
+        :param Path path:  Path to database file
+        """
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def upsert(self, items, queries=None):
+        """
+        Add items to the dataset, or update them if they already exist
+
+        :param items:  Iterable of items, as produced by the scraper
+        :param dict queries:  Queries each item was scraped for, as a mapping
+        of thread IDs to a collection of queries
+        :return tuple:  Amount of new items, amount of updated items
+        """
+        # INSERT ... ON CONFLICT DO UPDATE would do this in one statement, but
+        # needs SQLite 3.24, which not all supported Python versions include
+        columns = ITEM_COLUMNS + ["first_seen", "last_seen"]
+        insert = "INSERT OR IGNORE INTO items (%s) VALUES (%s)" % (", ".join(columns), ", ".join(["?"] * len(columns)))
+
+        # a scrape without files leaves the file columns empty, but the files
+        # saved by earlier scrapes are still there, so keep the paths to them
+        update_columns = [column for column in ITEM_COLUMNS if column != "id"]
+        update = "UPDATE items SET %s, last_seen = ? WHERE id = ?" % ", ".join(
+            [("%s = COALESCE(NULLIF(?, ''), %s)" % (column, column)) if column in FILE_COLUMNS else ("%s = ?" % column)
+             for column in update_columns])
+
+        if not queries:
+            queries = {}
+
+        now = int(time.time())
+        new = set()
+        updated = set()
+
+        with self.db:
+            for item in items:
+                inserted = self.db.execute(insert, [item.get(column, "") for column in ITEM_COLUMNS] + [now, now])
+                if inserted.rowcount:
+                    new.add(item["id"])
+                else:
+                    self.db.execute(update, [item.get(column, "") for column in update_columns] + [now, item["id"]])
+                    updated.add(item["id"])
+
+                self.db.executemany("INSERT OR IGNORE INTO item_queries (id, query) VALUES (?, ?)",
+                                    [(item["id"], query) for query in queries.get(item["thread_id"], ())])
+
+        # items that occur more than once in the same batch are only new
+        return len(new), len(updated - new)
+
+    def select(self, query=None, author=None, thread_id=None, since=None, until=None):
+        """
+        Get items from the dataset
+
+        :param str query:  Only items scraped for this query
+        :param str author:  Only items by this author
+        :param str thread_id:  Only items in this thread
+        :param int since:  Only items posted at or after this timestamp
+        :param int until:  Only items posted before this timestamp
+        :return:  Generator yielding items as dictionaries, in the scraper's
+        column order, sorted by timestamp
+        """
+        where = []
+        values = []
+        if query is not None:
+            where.append("id IN (SELECT id FROM item_queries WHERE query = ?)")
+            values.append(query)
+
+        if author is not None:
+            where.append("author = ?")
+            values.append(author)
+
+        if thread_id is not None:
+            where.append("thread_id = ?")
+            values.append(thread_id)
+
+        if since is not None:
+            where.append("timestamp >= ?")
+            values.append(since)
+
+        if until is not None:
+            where.append("timestamp < ?")
+            values.append(until)
+
+        statement = "SELECT %s FROM items" % ", ".join(DEFAULT_COLUMNS)
+        if where:
+            statement += " WHERE " + " AND ".join(where)
+        statement += " ORDER BY timestamp"
+
+        for row in self.db.execute(statement, values):
+            yield dict(row)
+
+    def history(self, item_id):
+        """
+        Get the counter history of an item
+
+        :param str item_id:  Item ID
+        :return list:  List of dictionaries with `seen_at`, `num_likes` and
+        `num_comments` keys, oldest first
+        """
+        return [dict(row) for row in self.db.execute(
+            "SELECT seen_at, num_likes, num_comments FROM counter_history WHERE id = ? ORDER BY seen_at", (item_id,))]
+
+    def close(self):
+        """
+        Close the dataset
+        """
+        self.db.close()
@@ -0,0 +1,104 @@
+import json
+import csv
+import sys
+
+# this seems to be compatible... mostly
+# at least it also imports properly into Google Sheets
+csv.register_dialect("excel-compat", delimiter=",", doublequote=True, escapechar="\\", lineterminator="\n",
+                     quotechar='"', quoting=csv.QUOTE_ALL, skipinitialspace=False, strict=False)
+
+# the columns of a regular scrape, in the order they are written
+DEFAULT_COLUMNS = ["id", "thread_id", "parent_id", "body", "author", "timestamp", "type", "url", "thumbnail_url",
+                   "hashtags", "usertags", "mentioned", "num_likes", "num_comments", "subject"]
+
+
+def read_csv(path):
+    """
+    Read items from a CSV file written by the scraper
+
+    :param Path path:  Path to CSV file
+    :return:  Generator yielding one dictionary per row
+    """
+    # captions can be longer than the default field size limit
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+    with path.open(encoding="utf-8", newline="") as infile:
+        yield from csv.DictReader(infile, dialect="excel-compat")
+
+
+def read_csv_columns(path):
+    """
+    Get the column names of a CSV file written by the scraper
+
+    :param Path path:  Path to CSV file
+    :return list:  Column names, empty if the file is empty
+    """
+    with path.open(encoding="utf-8", newline="") as infile:
+        return next(csv.reader(infile, dialect="excel-compat"), [])
+
+
+def write_csv(path, items, fieldnames=None):
+    """
+    Write items to a CSV file that can be imported into 4CAT
+
+    Items are written one by one, so this also works for generators that
+    yield more items than would comfortably fit in memory.
+
+    :param Path path:  Path to write CSV file to
+    :param items:  Iterable of dictionaries, one per row
+    :param list fieldnames:  Columns to write; if not given, the keys of the
+    first item are used
+    :return int:  Amount of rows written
+    """
+    rows = 0
+    with path.open("w", encoding="utf-8") as output:
+        writer = None
+        if fieldnames:
+            # write the header even if there are no items
+            writer = csv.DictWriter(output, fieldnames=fieldnames, dialect="excel-compat")
+            writer.writeheader()
+
+        for item in items:
+            if not writer:
+                writer = csv.DictWriter(output, fieldnames=list(item.keys()), dialect="excel-compat")
+                writer.writeheader()
+
+            writer.writerow(item)
+            rows += 1
+
+    return rows
+
+
+def write_ndjson(path, items):
+    """
+    Write items to a newline-delimited JSON file
+
+    :param Path path:  Path to write file to
+    :param items:  Iterable of dictionaries, one per line
+    :return int:  Amount of lines written
+    """
+    rows = 0
+    with path.open("w", encoding="utf-8") as output:
+        for item in items:
+            output.write(json.dumps(item) + "\n")
+            rows += 1
+
+    return rows
+
+
+def write_items(path, items, fieldnames=None):
+    """
+    Write items to a file, with the format determined by its extension
+
+    `.ndjson` and `.jsonl` files are written as newline-delimited JSON; all
+    other files are written as CSV.
+
+    :param Path path:  File to write to
+    :param items:  Iterable of dictionaries
+    :param list fieldnames:  Columns, for CSV files
+    :return int:  Amount of items written
+    """
+    if path.suffix.lower() in (".ndjson", ".jsonl"):
+        return write_ndjson(path, items)
+    else:
+        return write_csv(path, items, fieldnames)
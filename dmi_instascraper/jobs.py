@@ -0,0 +1,428 @@
+import threading
+import sqlite3
+import socket
+import json
+import time
+import os
+
+from dmi_instascraper.scraper import Scraper
+from dmi_instascraper.dataset import Dataset
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT,
+    state TEXT DEFAULT 'pending',
+    priority INTEGER DEFAULT 0,
+    options TEXT DEFAULT '{}',
+    attempts INTEGER DEFAULT 0,
+    not_before INTEGER DEFAULT 0,
+    created_at INTEGER,
+    started_at INTEGER,
+    finished_at INTEGER,
+    items INTEGER,
+    duration REAL,
+    error TEXT,
+    runner TEXT,
+    heartbeat INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS jobs_next ON jobs (state, priority, not_before);
+"""
+
+# options a job can have, and their defaults
+JOB_OPTIONS = {
+    "max_posts": 50,
+    "scrape_comments": False,
+    "scrape_files": False,
+    "scrape_metadata": False,
+    "scrape_archive": False,
+    "time_budget": 0,
+    "request_budget": 0
+}
+
+# columns added after the first version of the queue, with their types, so
+# existing queues can be upgraded
+ADDED_COLUMNS = {
+    "runner": "TEXT",
+    "heartbeat": "INTEGER"
+}
+
+# seconds between heartbeats of a running job
+HEARTBEAT_INTERVAL = 60
+
+
+def complete_options(options=None):
+    """
+    Check scrape options and fill in defaults for those not given
+
+    :param dict options:  Scrape options, see `JOB_OPTIONS`
+    :return dict:  All scrape options
+    """
+    options = {**JOB_OPTIONS, **(options if options else {})}
+    unknown = [option for option in options if option not in JOB_OPTIONS]
+    if unknown:
+        raise ValueError("Unknown option(s): %s" % ", ".join(unknown))
+
+    return options
+
+
+class JobQueue:
+    """
+    Persistent job queue
+
+    Each job is one query to scrape, with its own priority and scrape options.
+    Jobs are kept in an SQLite database, so the queue survives restarts of the
+    scraper. A job is either 'pending', 'running', 'done' or 'failed'; failed
+    jobs are retried a few times before they are given up on.
+
+    Several runners can work on the same queue at the same time. Each running
+    job records which runner claimed it, and that runner regularly updates
+    the job's heartbeat; a running job whose heartbeat stops was left behind
+    by a runner that stopped unexpectedly, and can be recovered.
+    """
+    def __init__(self, path, max_attempts=3, retry_delay=300, stale_after=HEARTBEAT_INTERVAL * 5):
+        """
+        Open job queue, creating it if it does not exist yet
+
+        :param Path path:  Path to database file
+        :param int max_attempts:  Amount of times a job is attempted before it
+        is marked as failed
+        :param int retry_delay:  Seconds to wait before retrying a job after
+        its first failure; doubles with every further failure
+        :param int stale_after:  Seconds without a heartbeat after which a
+        running job is considered abandoned
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stale_after = stale_after
+        self.runner_id = "%s:%i" % (socket.gethostname(), os.getpid())
+        self.db = sqlite3.connect(str(path), isolation_level=None, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+        existing = [column["name"] for column in self.db.execute("PRAGMA table_info(jobs)")]
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self.db.execute("ALTER TABLE jobs ADD COLUMN %s %s" % (column, column_type))
+
+    def add(self, query, priority=0, options=None):
+        """
+        Add a job to the queue
+
+        :param str query:  Query to scrape, #hashtag or @user
+        :param int priority:  Jobs with a higher priority are run first
+        :param dict options:  Scrape options, see `JOB_OPTIONS`
+        :return int:  Job ID
+        """
+        options = complete_options(options)
+        cursor = self.db.execute("INSERT INTO jobs (query, priority, options, created_at) VALUES (?, ?, ?, ?)",
+                                 (query.strip(), priority, json.dumps(options), int(time.time())))
+        return cursor.lastrowid
+
+    def claim(self):
+        """
+        Get the next job to run and mark it as running
+
+        The job with the highest priority that is not waiting to be retried is
+        claimed; of jobs with the same priority, the oldest goes first.
+
+        :return dict:  Job, or `None` if no job is available right now
+        """
+        now = int(time.time())
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            job = self.db.execute("SELECT * FROM jobs WHERE state = 'pending' AND not_before <= ? "
+                                  "ORDER BY priority DESC, id ASC LIMIT 1", (now,)).fetchone()
+            if job:
+                self.db.execute("UPDATE jobs SET state = 'running', started_at = ?, attempts = attempts + 1, "
+                                "runner = ?, heartbeat = ? WHERE id = ?", (now, self.runner_id, now, job["id"]))
+        finally:
+            self.db.execute("COMMIT")
+
+        if not job:
+            return None
+
+        job = dict(job)
+        job["options"] = {**JOB_OPTIONS, **json.loads(job["options"])}
+        job["attempts"] += 1
+        job["runner"] = self.runner_id
+        return job
+
+    def heartbeat(self, job):
+        """
+        Register that a running job is still being worked on
+
+        :param dict job:  Job, as returned by `claim()`
+        """
+        self.db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = 'running' AND runner = ?",
+                        (int(time.time()), job["id"], job["runner"]))
+
+    def owns(self, job):
+        """
+        Check if a job is still running under the runner that claimed it
+
+        A job is no longer owned if its heartbeat stopped for long enough
+        that another runner recovered it, e.g. because the computer was
+        asleep; the results of the original runner should then be discarded.
+
+        :param dict job:  Job, as returned by `claim()`
+        :return bool:  Whether the job is still owned
+        """
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE id = ? AND state = 'running' AND runner = ?",
+                               (job["id"], job["runner"])).fetchone()[0] > 0
+
+    def finish(self, job, items, duration):
+        """
+        Mark a job as done
+
+        Jobs that are no longer owned by the runner (see `owns()`) are left
+        alone.
+
+        :param dict job:  Job, as returned by `claim()`
+        :param int items:  Amount of items scraped
+        :param float duration:  Seconds it took to run the job
+        :return bool:  Whether the job was still owned and marked as done
+        """
+        return self.db.execute("UPDATE jobs SET state = 'done', finished_at = ?, items = ?, duration = ?, "
+                               "error = NULL WHERE id = ? AND state = 'running' AND runner = ?",
+                               (int(time.time()), items, duration, job["id"], job["runner"])).rowcount > 0
+
+    def fail(self, job, error):
+        """
+        Mark a job as failed
+
+        If the job has been attempted fewer than the maximum amount of times,
+        it is queued again, to be retried after a delay.
+
+        Jobs that are no longer owned by the runner (see `owns()`) are left
+        alone.
+
+        :param dict job:  Job, as returned by `claim()`
+        :param str error:  Description of what went wrong
+        :return bool:  Whether the job was still owned and marked as failed
+        """
+        now = int(time.time())
+        if job["attempts"] < self.max_attempts:
+            delay = self.retry_delay * (2 ** (job["attempts"] - 1))
+            cursor = self.db.execute("UPDATE jobs SET state = 'pending', not_before = ?, error = ? "
+                                     "WHERE id = ? AND state = 'running' AND runner = ?",
+                                     (now + delay, error, job["id"], job["runner"]))
+        else:
+            cursor = self.db.execute("UPDATE jobs SET state = 'failed', finished_at = ?, error = ? "
+                                     "WHERE id = ? AND state = 'running' AND runner = ?",
+                                     (now, error, job["id"], job["runner"]))
+
+        return cursor.rowcount > 0
+
+    def release(self, job):
+        """
+        Put a running job back in the queue without counting it as an attempt
+
+        Used when the scraper is stopped while running a job. Jobs that are
+        no longer owned by the runner (see `owns()`) are left alone.
+
+        :param dict job:  Job, as returned by `claim()`
+        :return bool:  Whether the job was still owned and put back
+        """
+        return self.db.execute("UPDATE jobs SET state = 'pending', attempts = attempts - 1 "
+                               "WHERE id = ? AND state = 'running' AND runner = ?",
+                               (job["id"], job["runner"])).rowcount > 0
+
+    def recover(self):
+        """
+        Put jobs that were left running back in the queue
+
+        Only jobs whose heartbeat has stopped are recovered; jobs that another
+        runner is still working on are left alone.
+
+        :return int:  Amount of jobs put back in the queue
+        """
+        stale = int(time.time()) - self.stale_after
+        return self.db.execute("UPDATE jobs SET state = 'pending', attempts = attempts - 1 "
+                               "WHERE state = 'running' AND COALESCE(heartbeat, started_at, 0) < ?",
+                               (stale,)).rowcount
+
+    def retry_failed(self):
+        """
+        Queue all failed jobs again, with a fresh set of attempts
+
+        :return int:  Amount of jobs queued again
+        """
+        return self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0, not_before = 0 "
+                               "WHERE state = 'failed'").rowcount
+
+    def next_retry(self):
+        """
+        Get the time at which the next delayed job can be run
+
+        :return int:  Timestamp, or `None` if there are no pending jobs
+        """
+        return self.db.execute("SELECT MIN(not_before) FROM jobs WHERE state = 'pending'").fetchone()[0]
+
+    def counts(self):
+        """
+        Get the amount of jobs per state
+
+        :return dict:  Amount of jobs, keyed by state
+        """
+        counts = {state: 0 for state in ("pending", "running", "done", "failed")}
+        for row in self.db.execute("SELECT state, COUNT(*) AS amount FROM jobs GROUP BY state"):
+            counts[row["state"]] = row["amount"]
+
+        return counts
+
+    def jobs(self, state=None):
+        """
+        Get jobs in the queue
+
+        :param str state:  Only get jobs with this state
+        :return list:  Jobs, as dictionaries
+        """
+        if state:
+            rows = self.db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,))
+        else:
+            rows = self.db.execute("SELECT * FROM jobs ORDER BY id")
+
+        return [dict(row) for row in rows]
+
+    def close(self):
+        """
+        Close the job queue
+        """
+        self.db.close()
+
+
+class JobRunner:
+    """
+    Works through a job queue
+
+    Claims jobs one by one, scrapes them, and adds the results to an SQLite
+    dataset.
+    """
+    def __init__(self, queue, dataset_path, log=print, session_file=None):
+        """
+        Instantiate runner
+
+        :param JobQueue queue:  Queue to take jobs from
+        :param Path dataset_path:  Dataset to add results to; files and the
+        raw data archive, if enabled for a job, are saved next to it
+        :param log:  Function to call with status messages
+        :param Path session_file:  File to keep the Instagram session in
+        between jobs and runs
+        """
+        self.queue = queue
+        self.session_file = session_file
+        self.dataset_path = dataset_path
+        self.log = log
+
+    def run(self, wait=False, poll_interval=30):
+        """
+        Run jobs until the queue is empty
+
+        :param bool wait:  Keep running and wait for new jobs when the queue
+        is empty, instead of returning
+        :param int poll_interval:  Seconds between checks for new jobs when
+        waiting
+        :return int:  Amount of jobs run
+        """
+        jobs_run = 0
+        while True:
+            # other runners may have stopped while this one was running
+            recovered = self.queue.recover()
+            if recovered:
+                self.log("Queued %i job(s) again that were interrupted earlier" % recovered)
+
+            job = self.queue.claim()
+            if not job:
+                next_retry = self.queue.next_retry()
+                if next_retry is None and not wait:
+                    break
+
+                delay = max(1, next_retry - time.time()) if next_retry is not None else poll_interval
+                time.sleep(min(delay, poll_interval))
+                continue
+
+            self.run_job(job)
+            jobs_run += 1
+
+        return jobs_run
+
+    def send_heartbeats(self, job, stopped):
+        """
+        Update the heartbeat of a running job until it is stopped
+
+        Runs in its own thread, with its own connection to the queue, so
+        heartbeats continue while the scraper waits for Instagram.
+
+        :param dict job:  Job, as returned by `JobQueue.claim()`
+        :param threading.Event stopped:  Set when the job has finished
+        """
+        queue = JobQueue(self.queue.path)
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                queue.heartbeat(job)
+        finally:
+            queue.close()
+
+    def log_message(self, job, data):
+        """
+        Log a status message from the scraper; progress is not reported
+
+        :param dict job:  Job the scraper is running
+        :param dict data:  Message: dict with two keys, 'type' and 'value'
+        """
+        if data["type"] == "log":
+            self.log("Job %i: %s" % (job["id"], data["value"]))
+
+    def run_job(self, job):
+        """
+        Run a single job
+
+        :param dict job:  Job, as returned by `JobQueue.claim()`
+        """
+        self.log("Job %i: scraping '%s' (attempt %i)" % (job["id"], job["query"], job["attempts"]))
+        options = job["options"]
+        scraper = Scraper([job["query"]], options["max_posts"], options["scrape_comments"], options["scrape_files"],
+                          options["scrape_metadata"], self.dataset_path.parent, self.dataset_path.name,
+                          scrape_archive=options["scrape_archive"], time_budget=options["time_budget"],
+                          request_budget=options["request_budget"], session_file=self.session_file,
+                          listener=lambda data: self.log_message(job, data))
+
+        stopped = threading.Event()
+        threading.Thread(target=self.send_heartbeats, args=(job, stopped), daemon=True).start()
+
+        start_time = time.time()
+        try:
+            scraper.run()
+        except KeyboardInterrupt:
+            self.queue.release(job)
+            raise
+        except Exception as e:
+            self.queue.fail(job, "%s: %s" % (e.__class__.__name__, e))
+            self.log("Job %i: failed (%s)" % (job["id"], e))
+            return
+        finally:
+            stopped.set()
+
+        duration = time.time() - start_time
+
+        if scraper.results is None or scraper.failed_queries:
+            self.queue.fail(job, "Could not retrieve posts")
+            self.log("Job %i: failed, could not retrieve posts" % job["id"])
+            return
+
+        if not self.queue.owns(job):
+            # another runner recovered the job while this one was not sending
+            # heartbeats, and will scrape it again
+            self.log("Job %i: taken over by another runner, discarding results" % job["id"])
+            return
+
+        dataset = Dataset(self.dataset_path)
+        new, updated = dataset.upsert(scraper.results, scraper.result_queries)
+        dataset.close()
+
+        self.queue.finish(job, len(scraper.results), duration)
+        self.log("Job %i: done, %i items (%i new) in %.1f seconds, %.2f items/second" % (
+            job["id"], len(scraper.results), new, duration, len(scraper.results) / max(duration, 0.001)))
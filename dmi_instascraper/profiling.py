@@ -0,0 +1,102 @@
+import tracemalloc
+import cProfile
+import pstats
+import io
+
+
+class ScrapeProfiler:
+    """
+    Profiler for a scrape
+
+    Combines cProfile, to see where time is spent, with tracemalloc snapshots
+    taken at checkpoints during the scrape, to see where memory is allocated.
+    Results are written to files that can be attached to bug reports.
+    """
+    def __init__(self, top=30):
+        """
+        Instantiate profiler
+
+        :param int top:  Amount of functions and allocation sites to include
+        in the report
+        """
+        self.top = top
+        self.profiler = cProfile.Profile()
+        self.snapshots = []
+
+    def start(self):
+        """
+        Start profiling
+
+        Note that cProfile only profiles the thread this is called from.
+        """
+        tracemalloc.start()
+        self.profiler.enable()
+
+    def checkpoint(self, label):
+        """
+        Take a memory snapshot
+
+        The profiler is paused while the snapshot is taken so taking it does
+        not show up in the timing results.
+
+        :param str label:  Description of the moment the snapshot is taken
+        """
+        if not tracemalloc.is_tracing():
+            return
+
+        self.profiler.disable()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        self.snapshots.append((label, snapshot))
+        self.profiler.enable()
+
+    def stop(self):
+        """
+        Stop profiling
+        """
+        self.profiler.disable()
+        tracemalloc.stop()
+
+    def write(self, folder, stem):
+        """
+        Write profiling results to files
+
+        Two files are written: a .pstats file with the full cProfile results,
+        which can be loaded with e.g. the pstats module or snakeviz, and a
+        plain text report with the slowest functions and the top allocation
+        sites per checkpoint.
+
+        :param Path folder:  Folder to write files to
+        :param str stem:  Base file name
+        :return list:  Paths of the files that were written
+        """
+        stats_path = folder.joinpath(stem + "-profile.pstats")
+        report_path = folder.joinpath(stem + "-profile.txt")
+
+        self.profiler.dump_stats(str(stats_path))
+
+        with report_path.open("w", encoding="utf-8") as report:
+            report.write("== Functions by cumulative time ==\n\n")
+            timings = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=timings)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            report.write(timings.getvalue())
+
+            previous = None
+            for label, snapshot in self.snapshots:
+                report.write("\n== Top allocation sites: %s ==\n\n" % label)
+                for statistic in snapshot.statistics("lineno")[:self.top]:
+                    report.write("%s\n" % statistic)
+
+                if previous:
+                    report.write("\n== Allocation growth since '%s' ==\n\n" % previous[0])
+                    for statistic in snapshot.compare_to(previous[1], "lineno")[:self.top]:
+                        report.write("%s\n" % statistic)
+
+                previous = (label, snapshot)
+
+        return [stats_path, report_path]
@@ -0,0 +1,605 @@
+import instaloader
+import threading
+import datetime
+import time
+import re
+
+from dmi_instascraper.budget import Budget, BudgetExhausted, BudgetScheduler
+from dmi_instascraper.profiling import ScrapeProfiler
+from dmi_instascraper.archive import ArchiveWriter, hashtag, mention, utc_timestamp
+from dmi_instascraper.aggregate import TagAggregator
+from dmi_instascraper.session import SessionState
+from pathlib import Path
+
+# a budgeted query is given up on after this many errors in a row
+MAX_QUERY_ERRORS = 3
+
+
+class Scraper(threading.Thread):
+    """
+    Instagram scraper class
+
+    Based on instaloader. Calls the requisite instaloader methods as required
+    by scrape parameters and collects posts in memory. At the end, the posts
+    are returned. While scraping, status and progress updates are passed to a
+    listener so the user can stay on top of what's happening.
+
+    This class does not depend on the GUI, so it can also be used from the
+    command line or in worker processes; it can be run in a thread with
+    start() or directly with run().
+    """
+    interrupted = False
+    results = None
+    result_queries = None
+    failed_queries = None
+    profiler = None
+    archive = None
+    budget = None
+    aggregator = None
+    session = None
+    instagram = None
+
+    def __init__(self, queries, max_posts, scrape_comments, scrape_files, scrape_metadata, scrape_target, scrape_filename, profile=False, scrape_archive=False, listener=None, time_budget=0, request_budget=0, scrape_tags=False, session_file=None):
+        """
+        Instantiate scraper
+
+        There are quite a few parameters and since we're running in a thread
+        these cannot be passed to the run() method directly. So instead save
+        them as object properties so they can be used later.
+
+        :param list queries:  List of queries, #hashtags or @users
+        :param int max_posts:  Posts to scrape per query
+        :param bool scrape_comments:  Also scrape comments and save in CSV?
+        :param bool scrape_files:  Also save photo files for each post?
+        :param bool scrape_metadata:  Also save metadata files for each post?
+        :param Path scrape_target:  Where to save scraped files
+        :param str scrape_filename:  File name for scrape results, not used
+        directly but used to derive container folder name
+        :param bool profile:  Profile the scrape and save the results next to
+        the results file?
+        :param bool scrape_archive:  Also save the raw data for each post and
+        comment in an archive, from which the results can be rebuilt later?
+        :param listener:  Function to call with status messages, progress
+        updates and status changes; see `send_message()`
+        :param float time_budget:  If set, scrape for at most this many
+        seconds, divided across queries
+        :param int request_budget:  If set, make at most this many requests,
+        divided across queries
+        :param bool scrape_tags:  Also count hashtags and mentions and save
+        summary tables and a hashtag network next to the results file?
+        :param Path session_file:  If set, resume the Instagram session saved
+        in this file, and save the session to it afterwards
+        """
+        super().__init__()
+        self.listener = listener
+        self.queries = queries
+        self.max_posts = max_posts
+        self.scrape_comments = scrape_comments
+        self.scrape_files = scrape_files
+        self.scrape_metadata = scrape_metadata
+        self.scrape_target = scrape_target
+        self.scrape_filename = scrape_filename
+        self.profile = profile
+        self.scrape_archive = scrape_archive
+        self.time_budget = time_budget
+        self.request_budget = request_budget
+        self.scrape_tags = scrape_tags
+        self.session_file = session_file
+
+    def send_message(self, data):
+        """
+        Send a message to the listener
+
+        :param dict data:  Message: dict with two keys, 'type' and 'value'.
+        The type is 'log', 'progress' or 'status'.
+        """
+        if self.listener:
+            self.listener(data)
+
+    def update_status(self, message):
+        """
+        Send a signal with a status update
+
+        :param message:  Message to send to logger
+        """
+        self.send_message({"type": "log", "value": message})
+
+    def update_progress(self, current, total):
+        """
+        Send a signal with a progress update
+
+        Progress is calculated via the given parameters
+
+        :param current:  Current amount of processed items
+        :param total:  Total amount of items to process
+        """
+        self.send_message({"type": "progress", "value": 100.0 * (float(current) / float(total))})
+
+    @staticmethod
+    def instaloaderError(send_message):
+        """
+        Intercept Instaloader error
+
+        Instaloader logs its errors to stderr. But we need to handle them in the
+        code here - so instaloader is monkey patched to override its error
+        logger and if it's the type of error we're interested in we pass it on to
+        the listener for logging.
+
+        :param send_message:  Function to send the message with
+        """
+        def wrapped_instaloaderError(context, msg, *args, **kwargs):
+            limited = re.findall(r"The request will be retried in ([0-9]+) seconds, at ([0-9:]+).", msg)
+            if limited:
+                seconds, next_attempt = limited[0]
+                send_message({"type": "log",
+                              "value": "Uh oh, Instagram noticed us! Waiting until %s before continuing..." % next_attempt})
+
+        return wrapped_instaloaderError
+
+    def checkpoint(self, label):
+        """
+        Take a memory snapshot, if the scrape is being profiled
+
+        :param str label:  Description of the current stage of the scrape
+        """
+        if self.profiler:
+            self.profiler.checkpoint(label)
+
+    def run(self):
+        """
+        Run scraper in thread
+
+        This in turn calls another function, because that way we can catch
+        exceptions in the scrape and clean them up as needed.
+        """
+        if self.profile:
+            self.profiler = ScrapeProfiler()
+            self.profiler.start()
+            self.checkpoint("start")
+
+        if self.scrape_archive:
+            archive_path = self.scrape_target.joinpath(Path(self.scrape_filename).stem + ".archive.ndjson.gz")
+            try:
+                self.archive = ArchiveWriter(archive_path)
+            except (FileNotFoundError, PermissionError):
+                self.update_status("Could not create archive file %s, continuing without it." % archive_path.name)
+
+        try:
+            self.scrape()
+        except RuntimeError as e:
+            self.send_message({"type": "status", "value": "INTERRUPTED"})
+            return
+        finally:
+            if self.session and self.instagram:
+                self.session.save(self.instagram.context)
+
+            if self.archive:
+                self.archive.close()
+                self.archive = None
+
+            if self.profiler:
+                self.write_profile()
+
+    def write_profile(self):
+        """
+        Stop profiling and write the results next to the results file
+        """
+        self.checkpoint("end")
+        self.profiler.stop()
+
+        try:
+            files = self.profiler.write(self.scrape_target, Path(self.scrape_filename).stem)
+            self.update_status("Profile written to %s" % ", ".join([file.name for file in files]))
+        except (FileNotFoundError, PermissionError):
+            self.update_status("Could not write profile. Try writing to another directory.")
+
+        self.profiler = None
+
+    def scrape(self):
+        """
+        Fetches data from Instagram via instaloader
+        """
+        # monkey patch the error handler because it prints to stderr and we
+        # want to handle the error in python instead
+        instaloader.instaloadercontext.InstaloaderContext.error = self.instaloaderError(self.send_message)
+
+        # resume the previous session, if there is one, with the same user
+        # agent and cookies
+        self.session = SessionState(self.session_file) if self.session_file else None
+
+        # instantiate instaloader
+        instagram = instaloader.Instaloader(
+            user_agent=self.session.user_agent if self.session else None,
+            quiet=True,
+            download_pictures=self.scrape_files,
+            download_videos=self.scrape_files,
+            download_comments=self.scrape_comments,
+            download_geotags=False,
+            download_video_thumbnails=False,
+            compress_json=False,
+            save_metadata=self.scrape_files
+        )
+        self.instagram = instagram
+
+        if self.session and self.session.restore(instagram.context):
+            self.update_status("Resuming previous Instagram session")
+
+        # ready our parameters
+        queries = [query.strip() for query in self.queries]
+        self.failed_queries = []
+        self.result_queries = {}
+        self.aggregator = TagAggregator() if self.scrape_tags else None
+
+        if self.time_budget or self.request_budget:
+            # count requests, so they can be charged to the budget
+            self.budget = Budget(self.time_budget, self.request_budget)
+            get_json = instagram.context.get_json
+
+            def counted_get_json(*args, **kwargs):
+                self.budget.count_request()
+                return get_json(*args, **kwargs)
+
+            instagram.context.get_json = counted_get_json
+
+            # instaloader's rate controller can wait for many minutes when
+            # throttled; rather than overrunning the time budget, give up
+            # if the wait is longer than the time that is left
+            rate_controller = getattr(instagram.context, "_rate_controller", None)
+            if self.time_budget and rate_controller is not None:
+                sleep = rate_controller.sleep
+
+                def budgeted_sleep(seconds):
+                    seconds_left = self.budget.seconds_left()
+                    if seconds_left is not None and seconds >= seconds_left:
+                        self.budget.run_out()
+                        raise BudgetExhausted("Instagram asked to wait %i seconds, but only %i seconds of the "
+                                              "budget are left" % (seconds, seconds_left))
+                    sleep(seconds)
+
+                rate_controller.sleep = budgeted_sleep
+
+            results = self.scrape_budgeted(instagram, queries)
+
+        else:
+            results = self.scrape_all(instagram, queries)
+
+        if self.aggregator:
+            self.write_tag_summary()
+
+        # remove temporary fetched data and return posts
+        self.results = results
+        self.send_message({"type": "status", "value": "DONE"})
+        return results
+
+    def aggregate(self, items):
+        """
+        Count hashtags and mentions in scraped items, if enabled
+
+        :param list items:  Scraped items
+        :return list:  The same items
+        """
+        if self.aggregator:
+            for item in items:
+                self.aggregator.add(item)
+
+        return items
+
+    def write_tag_summary(self):
+        """
+        Write hashtag and mention summaries next to the results file
+        """
+        try:
+            files = self.aggregator.write(self.scrape_target, Path(self.scrape_filename).stem)
+            self.update_status("Hashtag summary written to %s" % ", ".join([file.name for file in files]))
+        except (FileNotFoundError, PermissionError):
+            self.update_status("Could not write hashtag summary. Try writing to another directory.")
+
+    def get_feed(self, instagram, query):
+        """
+        Get the posts for a query
+
+        :param instaloader.Instaloader instagram:  Instaloader instance
+        :param str query:  Query, #hashtag or @user
+        :return tuple:  Query without # or @, and an iterator of posts
+        """
+        if query[0] == "@":
+            query = query.replace("@", "")
+            profile = instaloader.Profile.from_username(instagram.context, query)
+            return query, profile.get_posts()
+        else:
+            query = query.replace("#", "")
+            return query, instagram.get_hashtag_posts(query)
+
+    def scrape_all(self, instagram, queries):
+        """
+        Scrape up to the maximum amount of posts for each query
+
+        First the posts are listed for each query, then they are downloaded
+        one by one.
+
+        :param instaloader.Instaloader instagram:  Instaloader instance
+        :param list queries:  Queries
+        :return list:  Scraped items
+        """
+        posts = []
+
+        # for each query, get items
+        for query in queries:
+            chunk_size = 0
+            self.update_status("Retrieving posts ('%s')" % query)
+            try:
+                query, chunk = self.get_feed(instagram, query)
+
+                # "chunk" is a generator so actually retrieve the posts next
+                posts_processed = 0
+                for post in chunk:
+                    if self.interrupted:
+                        raise RuntimeError("Interrupted while fetching posts from Instagram")
+
+                    chunk_size += 1
+                    self.update_status("Retrieving post list ('%s', %i posts)" % (query, chunk_size))
+                    if posts_processed >= self.max_posts:
+                        break
+                    try:
+                        posts.append(chunk.__next__())
+                        posts[-1].query = query
+                        posts_processed += 1
+                    except StopIteration:
+                        break
+
+            except instaloader.InstaloaderException as e:
+                # should we abort here and return 0 posts?
+                self.update_status("Error while retrieving posts for query '%s'" % query)
+                self.failed_queries.append(query)
+
+        self.checkpoint("post list retrieved (%i posts)" % len(posts))
+
+        # go through posts, and retrieve comments
+        results = []
+        posts_processed = 0
+        comments_bit = " and comments" if self.scrape_comments else ""
+
+        for post in posts:
+            if self.interrupted:
+                raise RuntimeError("Interrupted while fetching post metadata from Instagram")
+
+            posts_processed += 1
+            self.update_status(
+                "Downloading post%s %s, %i/%i" % (comments_bit, post.shortcode, posts_processed, len(posts)))
+            self.update_progress(posts_processed, len(posts))
+
+            results += self.aggregate(self.scrape_post(instagram, post))
+
+        return results
+
+    def scrape_budgeted(self, instagram, queries):
+        """
+        Scrape as many posts for each query as the budget allows
+
+        Posts are fetched and downloaded one at a time, each time for the
+        query that has used the least of the budget so far, until the budget
+        runs out or no query has posts left. See `BudgetScheduler`.
+
+        Errors, e.g. when a query is throttled or a post cannot be
+        downloaded, cost the query its share of the budget but do not end it,
+        unless its posts could not be listed at all or the errors keep
+        happening.
+
+        :param instaloader.Instaloader instagram:  Instaloader instance
+        :param list queries:  Queries
+        :return list:  Scraped items
+        """
+        scheduler = BudgetScheduler(queries, self.budget, self.max_posts if self.max_posts > 0 else 0)
+        feeds = {}
+        seen = {query: set() for query in scheduler.active}
+        errors = {query: 0 for query in scheduler.active}
+        results = []
+        posts_processed = 0
+        comments_bit = " and comments" if self.scrape_comments else ""
+
+        def query_error(query, message):
+            errors[query] += 1
+            if not scheduler.posts[query] or errors[query] >= MAX_QUERY_ERRORS:
+                self.update_status("%s, giving up on '%s'" % (message, query))
+                scheduler.retire(query)
+                if not scheduler.posts[query]:
+                    self.failed_queries.append(query)
+            else:
+                self.update_status("%s, trying '%s' again later" % (message, query))
+
+        while True:
+            if self.interrupted:
+                raise RuntimeError("Interrupted while fetching posts from Instagram")
+
+            query = scheduler.next_query()
+            if query is None:
+                break
+
+            started_at = time.time()
+            requests_made = self.budget.requests_made
+            posts = 0
+            post = None
+            try:
+                if query not in feeds:
+                    self.update_status("Retrieving posts ('%s')" % query)
+                    feeds[query] = self.get_feed(instagram, query)
+
+                query_name, feed = feeds[query]
+                post = next(feed)
+                while post.shortcode in seen[query]:
+                    # the feed is listed again from the start after an error
+                    post = next(feed)
+
+            except StopIteration:
+                self.update_status("No more posts for '%s'" % query)
+                scheduler.retire(query)
+
+            except BudgetExhausted as e:
+                self.update_status("%s, stopping" % e)
+                self.budget.run_out()
+
+            except instaloader.InstaloaderException:
+                # the feed cannot be continued after an error, so list it
+                # again next time
+                feeds.pop(query, None)
+                post = None
+                query_error(query, "Error while retrieving posts for query '%s'" % query)
+
+            if post is not None:
+                seen[query].add(post.shortcode)
+                post.query = query_name
+                posts_processed += 1
+                self.update_status("Downloading post%s %s ('%s'), %i posts, %i%% of budget used" % (
+                    comments_bit, post.shortcode, query_name, posts_processed, self.budget.used() * 100))
+
+                try:
+                    results += self.aggregate(self.scrape_post(instagram, post))
+                    posts = 1
+                    errors[query] = 0
+
+                except BudgetExhausted as e:
+                    self.update_status("%s, stopping" % e)
+                    self.budget.run_out()
+
+                except instaloader.InstaloaderException:
+                    query_error(query, "Could not download post %s" % post.shortcode)
+
+            scheduler.charge(query, time.time() - started_at, self.budget.requests_made - requests_made, posts)
+            self.update_progress(self.budget.used() * 100, 100)
+
+        if self.budget.exhausted():
+            self.update_status("Budget used up. Posts per query: %s" % ", ".join(
+                ["%s: %i" % (query, amount) for query, amount in scheduler.posts.items()]))
+
+        return results
+
+    def scrape_post(self, instagram, post):
+        """
+        Download a post and, if enabled, its comments and files
+
+        :param instaloader.Instaloader instagram:  Instaloader instance
+        :param instaloader.Post post:  Post, with the query it was scraped for
+        as its `query` attribute
+        :return list:  Scraped items: the post, followed by its comments
+        """
+        extra_columns = {}
+
+        if self.scrape_files:
+            extra_columns["photo_file"] = ""
+
+        if self.scrape_metadata:
+            extra_columns["metadata_file"] = ""
+
+        thread_id = post.shortcode
+
+        try:
+            post_data = {
+                "id": thread_id,
+                "thread_id": thread_id,
+                "parent_id": thread_id,
+                "body": post.caption if post.caption is not None else "",
+                "author": post.owner_username,
+                "timestamp": utc_timestamp(post.date_utc),
+                "type": "video" if post.is_video else "picture",
+                "url": post.video_url if post.is_video else post.url,
+                "thumbnail_url": post.url,
+                "hashtags": ",".join(post.caption_hashtags),
+                "usertags": ",".join(post.tagged_users),
+                "mentioned": ",".join(mention.findall(post.caption) if post.caption else ""),
+                "num_likes": post.likes,
+                "num_comments": post.comments,
+                "subject": "",
+                **extra_columns
+            }
+        except (KeyError, instaloader.QueryReturnedNotFoundException, instaloader.ConnectionException):
+            return []
+
+        if self.scrape_files or self.scrape_metadata:
+            files_folder = self.scrape_target.joinpath(".".join(self.scrape_filename.split(".")[:-1]))
+            if not files_folder.exists() or not files_folder.is_dir():
+                files_folder.mkdir()
+
+        if self.scrape_files:
+            instagram.download_pic(str(files_folder.joinpath(thread_id)), post.url, datetime.datetime.now())
+            ext = ".jpg" if not post.is_video else ".mp4"
+            post_data["photo_file"] = str(files_folder.joinpath(thread_id + ext))
+            #instagram.download_post(post, self.scrape_target.joinpath(post.query).joinpath(post.shortcode))
+
+        if self.scrape_metadata:
+            instagram.save_metadata_json(str(files_folder.joinpath(thread_id)), post)
+            post_data["metadata_file"] = str(files_folder.joinpath(thread_id + ".json"))
+
+        results = [post_data]
+        self.result_queries.setdefault(thread_id, set()).add(post.query)
+        if self.archive:
+            self.archive.add_post(post, post.query)
+
+        if not self.scrape_comments:
+            return results
+
+        try:
+            for comment in post.get_comments():
+                if self.budget and self.budget.exhausted():
+                    self.update_status("Budget used up, not retrieving more comments for post %s" % thread_id)
+                    break
+
+                answers = [answer for answer in comment.answers]
+
+                try:
+                    results.append({
+                        "id": comment.id,
+                        "thread_id": thread_id,
+                        "parent_id": thread_id,
+                        "body": comment.text,
+                        "author": comment.owner.username,
+                        "timestamp": utc_timestamp(comment.created_at_utc),
+                        "type": "comment",
+                        "url": "",
+                        "hashtags": ",".join(hashtag.findall(comment.text)),
+                        "usertags": "",
+                        "mentioned": ",".join(mention.findall(comment.text)),
+                        "num_likes": comment.likes_count if hasattr(comment, "likes_count") else 0,
+                        "num_comments": len(answers),
+                        "subject": "",
+                        **extra_columns
+                    })
+                    if self.archive:
+                        self.archive.add_comment(comment, post.query, thread_id, thread_id, len(answers))
+                except (KeyError, instaloader.QueryReturnedNotFoundException, instaloader.ConnectionException):
+                    pass
+
+                # instagram only has one reply depth level at the time of
+                # writing, represented here
+                for answer in answers:
+                    try:
+                        results.append({
+                            "id": answer.id,
+                            "thread_id": thread_id,
+                            "parent_id": comment.id,
+                            "body": answer.text,
+                            "author": answer.owner.username,
+                            "timestamp": utc_timestamp(answer.created_at_utc),
+                            "type": "comment",
+                            "url": "",
+                            "hashtags": ",".join(hashtag.findall(answer.text)),
+                            "usertags": "",
+                            "mentioned": ",".join(mention.findall(answer.text)),
+                            "num_likes": answer.likes_count if hasattr(answer, "likes_count") else 0,
+                            "num_comments": 0,
+                            "subject": "",
+                            **extra_columns
+                        })
+                        if self.archive:
+                            self.archive.add_comment(answer, post.query, thread_id, comment.id)
+                    except (KeyError, instaloader.QueryReturnedNotFoundException, instaloader.ConnectionException):
+                        pass
+
+        except (instaloader.QueryReturnedNotFoundException, instaloader.ConnectionException):
+            # data not available...? this happens sometimes, not clear why
+            pass
+
+        except BudgetExhausted as e:
+            # keep the comments retrieved so far
+            self.update_status("%s, not retrieving more comments for post %s" % (e, thread_id))
+
+        return results
@@ -0,0 +1,136 @@
+import tempfile
+import json
+import time
+import os
+
+from pathlib import Path
+
+# requests older than this are no longer taken into account by instaloader's
+# rate controller, so there is no need to keep them
+HISTORY_SECONDS = 60 * 60
+
+
+def default_session_path():
+    """
+    Get the path of the session state file shared by scrapes on this computer
+
+    :return Path:  Path to session state file
+    """
+    return Path.home().joinpath(".dmi-instascraper", "session.json")
+
+
+class SessionState:
+    """
+    Instagram session state
+
+    Saves the state of an instaloader session between scrapes: the session
+    cookies, the user agent, and the times of recent requests as tracked by
+    instaloader's rate controller. A new scrape that restores this state
+    reuses the established session, and its rate controller paces requests
+    knowing what was requested recently, instead of starting with a burst of
+    requests that gets throttled straight away.
+
+    instaloader tracks request times with a monotonic clock, which is only
+    meaningful within one process, so times are converted to and from
+    wall-clock time when saving and restoring.
+    """
+    def __init__(self, path):
+        """
+        Load session state, if it was saved before
+
+        :param Path path:  Path to session state file
+        """
+        self.path = path
+        self.state = {}
+
+        try:
+            with path.open(encoding="utf-8") as infile:
+                self.state = json.load(infile)
+        except (OSError, ValueError):
+            self.state = {}
+
+    @property
+    def user_agent(self):
+        """
+        User agent of the saved session
+
+        :return str:  User agent, or `None` if no session was saved
+        """
+        return self.state.get("user_agent")
+
+    def restore(self, context):
+        """
+        Restore saved state into an instaloader context
+
+        :param instaloader.InstaloaderContext context:  Context to restore
+        state into
+        :return bool:  Whether there was a saved state to restore
+        """
+        if not self.state:
+            return False
+
+        context._session.cookies.update(self.state.get("cookies", {}))
+
+        # convert wall-clock times back to this process's monotonic clock
+        offset = time.monotonic() - time.time()
+        oldest = time.time() - HISTORY_SECONDS
+        rate_controller = getattr(context, "_rate_controller", None)
+        if rate_controller is not None and hasattr(rate_controller, "_query_timestamps"):
+            for query_type, timestamps in self.state.get("query_timestamps", {}).items():
+                restored = [timestamp + offset for timestamp in timestamps if timestamp > oldest]
+                rate_controller._query_timestamps[query_type] = sorted(
+                    rate_controller._query_timestamps.get(query_type, []) + restored)
+
+            if self.state.get("earliest_next_request_time", 0) > time.time():
+                rate_controller._earliest_next_request_time = max(
+                    rate_controller._earliest_next_request_time, self.state["earliest_next_request_time"] + offset)
+
+        return True
+
+    def save(self, context):
+        """
+        Save the state of an instaloader context
+
+        :param instaloader.InstaloaderContext context:  Context to save
+        state of
+        :return bool:  Whether the state could be saved
+        """
+        # convert monotonic times to wall-clock time
+        offset = time.time() - time.monotonic()
+        oldest = time.time() - HISTORY_SECONDS
+        state = {
+            "saved_at": int(time.time()),
+            "user_agent": context.user_agent,
+            "cookies": {cookie.name: cookie.value for cookie in context._session.cookies},
+            "query_timestamps": {},
+            "earliest_next_request_time": 0
+        }
+
+        rate_controller = getattr(context, "_rate_controller", None)
+        if rate_controller is not None and hasattr(rate_controller, "_query_timestamps"):
+            for query_type, timestamps in rate_controller._query_timestamps.items():
+                state["query_timestamps"][query_type] = [timestamp + offset for timestamp in timestamps
+                                                         if timestamp + offset > oldest]
+
+            if rate_controller._earliest_next_request_time:
+                state["earliest_next_request_time"] = rate_controller._earliest_next_request_time + offset
+
+        # the cookies identify the session, so keep them private: write to a
+        # temporary file that only the user can read (mkstemp creates it with
+        # mode 0600), then replace the old file with it, so a crash while
+        # writing cannot leave a truncated session file either
+        temp_path = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=str(self.path.parent), prefix=self.path.name + ".",
+                                                 suffix=".tmp")
+            with os.fdopen(handle, "w", encoding="utf-8") as outfile:
+                json.dump(state, outfile)
+            os.replace(temp_path, str(self.path))
+        except OSError:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        self.state = state
+        return True
@@ -0,0 +1,233 @@
+import multiprocessing
+import socket
+import json
+import time
+
+from dmi_instascraper.export import read_csv, read_csv_columns, write_items
+from dmi_instascraper.jobs import complete_options
+from dmi_instascraper.scraper import Scraper
+
+MANIFEST_FORMAT = "dmi-instascraper-shard"
+MANIFEST_VERSION = 1
+
+# manifests get their own extension, so they can be told apart from the
+# other JSON files that are saved next to them
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def create_shards(queries, shards, folder, options=None, name="shard"):
+    """
+    Split a list of queries into shards
+
+    Each shard is described by a manifest, a JSON file with the queries and
+    scrape options for that shard. Manifests can be copied to other machines
+    and run there with `run_shard()`. Queries are distributed round-robin, so
+    shards differ in size by at most one query.
+
+    :param list queries:  Queries, #hashtags or @users
+    :param int shards:  Amount of shards to create
+    :param Path folder:  Folder to write manifests to
+    :param dict options:  Scrape options, see `jobs.JOB_OPTIONS`
+    :param str name:  Base name for manifest and output files
+    :return list:  Paths of the manifests that were written
+    """
+    options = complete_options(options)
+
+    # remove duplicates but keep the order
+    queries = list(dict.fromkeys([query.strip() for query in queries if query.strip()]))
+    shards = max(1, min(shards, len(queries)))
+
+    manifests = []
+    for shard in range(shards):
+        shard_name = "%s-%i-of-%i" % (name, shard + 1, shards)
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "shard": shard + 1,
+            "shards": shards,
+            "queries": queries[shard::shards],
+            "options": options,
+            "output": shard_name + ".csv"
+        }
+
+        path = folder.joinpath(shard_name + MANIFEST_SUFFIX)
+        with path.open("w", encoding="utf-8") as outfile:
+            json.dump(manifest, outfile, indent=2)
+        manifests.append(path)
+
+    return manifests
+
+
+def read_manifest(path):
+    """
+    Read and validate a shard manifest
+
+    :param Path path:  Path to manifest
+    :return dict:  Manifest
+    """
+    with path.open(encoding="utf-8") as infile:
+        manifest = json.load(infile)
+
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("%s is not a version %i shard manifest" % (path.name, MANIFEST_VERSION))
+
+    return manifest
+
+
+def run_shard(path, log=print):
+    """
+    Scrape the queries in a shard
+
+    Results are written to the output file named in the manifest, next to the
+    manifest, together with a .stats.json file with statistics that are
+    combined when merging shards. Each shard keeps its own Instagram session
+    in a .session.json file next to its results, so a shard that is run again
+    resumes its session, and shards running in parallel do not share one.
+
+    :param Path path:  Path to manifest
+    :param log:  Function to call with status messages
+    :return dict:  Statistics for the shard
+    """
+    manifest = read_manifest(path)
+    options = complete_options(manifest["options"])
+    output = path.parent.joinpath(manifest["output"])
+
+    def listener(data):
+        if data["type"] == "log":
+            log("[shard %i/%i] %s" % (manifest["shard"], manifest["shards"], data["value"]))
+
+    scraper = Scraper(manifest["queries"], options["max_posts"], options["scrape_comments"], options["scrape_files"],
+                      options["scrape_metadata"], path.parent, output.name, scrape_archive=options["scrape_archive"],
+                      time_budget=options["time_budget"], request_budget=options["request_budget"],
+                      session_file=output.with_name(output.stem + ".session.json"), listener=listener)
+
+    started_at = time.time()
+    scraper.run()
+    finished_at = time.time()
+
+    results = scraper.results if scraper.results else []
+    stats = {
+        "shards": 1,
+        "hosts": [socket.gethostname()],
+        "queries": len(manifest["queries"]),
+        "failed_queries": scraper.failed_queries if scraper.failed_queries else [],
+        "posts": len([item for item in results if item["type"] != "comment"]),
+        "comments": len([item for item in results if item["type"] == "comment"]),
+        "items": len(results),
+        "started_at": int(started_at),
+        "finished_at": int(finished_at),
+        "duration": finished_at - started_at
+    }
+
+    write_items(output, results)
+    with stats_path(output).open("w", encoding="utf-8") as outfile:
+        json.dump(stats, outfile, indent=2)
+
+    return stats
+
+
+def _run_shard_process(path):
+    """
+    Run a shard in a worker process
+
+    Module-level so it can be used with multiprocessing. Errors are returned
+    rather than raised, so one failing shard does not affect the others.
+
+    :param Path path:  Path to manifest
+    :return tuple:  Path to manifest, statistics for the shard or `None` if
+    it failed, and a description of the error or `None` if it did not
+    """
+    try:
+        return path, run_shard(path, log=lambda message: print(message, flush=True)), None
+    except Exception as e:
+        return path, None, "%s: %s" % (e.__class__.__name__, e)
+
+
+def run_local(paths, processes):
+    """
+    Run shards in parallel worker processes on this machine
+
+    Each process scrapes with its own instaloader session. A single shard is
+    run in this process.
+
+    :param list paths:  Paths to manifests
+    :param int processes:  Maximum amount of shards to run at the same time
+    :return list:  Path, statistics and error for each shard, see
+    `_run_shard_process()`, in the order in which they finished
+    """
+    if len(paths) == 1:
+        return [_run_shard_process(paths[0])]
+
+    with multiprocessing.Pool(processes=max(1, min(processes, len(paths)))) as pool:
+        return list(pool.imap_unordered(_run_shard_process, paths, chunksize=1))
+
+
+def stats_path(output):
+    """
+    Get the path of the statistics file for a results file
+
+    :param Path output:  Path to results file
+    :return Path:  Path to statistics file
+    """
+    return output.with_name(output.stem + ".stats.json")
+
+
+def merge(inputs, output):
+    """
+    Merge shard results into a single dataset
+
+    Items that occur in more than one shard (e.g. posts that match queries in
+    different shards) are only included once, based on their ID. Items are
+    streamed, so only the IDs need to fit in memory. Statistics of the shards
+    are combined and written next to the merged file. Shards scraped with
+    different options can have different columns; the merged file has all of
+    them, and items lacking a column have it empty.
+
+    :param list inputs:  Paths to CSV files to merge
+    :param Path output:  Path to merged file, .csv or .ndjson
+    :return dict:  Combined statistics
+    """
+    seen = set()
+    # duration is the total time spent scraping by all shards; the difference
+    # between started_at and finished_at is the wall-clock time
+    stats = {"shards": 0, "hosts": [], "queries": 0, "failed_queries": [], "posts": 0, "comments": 0,
+             "items": 0, "items_in": 0, "duplicates": 0, "started_at": None, "finished_at": None,
+             "duration": 0}
+
+    def items():
+        for path in inputs:
+            for item in read_csv(path):
+                stats["items_in"] += 1
+                if item["id"] in seen:
+                    stats["duplicates"] += 1
+                    continue
+
+                seen.add(item["id"])
+                if item["type"] == "comment":
+                    stats["comments"] += 1
+                else:
+                    stats["posts"] += 1
+                yield item
+
+    columns = list(dict.fromkeys([column for path in inputs for column in read_csv_columns(path)]))
+    stats["items"] = write_items(output, items(), columns)
+
+    for path in inputs:
+        if not stats_path(path).exists():
+            continue
+
+        with stats_path(path).open(encoding="utf-8") as infile:
+            shard_stats = json.load(infile)
+
+        stats["shards"] += shard_stats["shards"]
+        stats["hosts"] = sorted(set(stats["hosts"] + shard_stats["hosts"]))
+        stats["queries"] += shard_stats["queries"]
+        stats["failed_queries"] += shard_stats["failed_queries"]
+        stats["duration"] += shard_stats["duration"]
+        stats["started_at"] = min(filter(None, (stats["started_at"], shard_stats["started_at"])))
+        stats["finished_at"] = max(filter(None, (stats["finished_at"], shard_stats["finished_at"])))
+
+    with stats_path(output).open("w", encoding="utf-8") as outfile:
+        json.dump(stats, outfile, indent=2)
+
+    return stats
@@ -0,0 +1,152 @@
+import datetime
+import wx
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of log lines
+
+    Once the buffer is full, each new line overwrites the oldest one, so memory
+    use and the cost of adding a line stay the same no matter how many lines
+    were logged before.
+    """
+    def __init__(self, capacity):
+        """
+        Instantiate buffer
+
+        :param int capacity:  Maximum amount of lines to keep
+        """
+        self.capacity = capacity
+        self.lines = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def append(self, line):
+        """
+        Add a line, dropping the oldest one if the buffer is full
+
+        :param str line:  Line to add
+        """
+        self.lines[(self.start + self.size) % self.capacity] = line
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def __getitem__(self, index):
+        """
+        Get a line by its position, 0 being the oldest line still kept
+
+        :param int index:  Position of the line
+        :return str:  Line
+        """
+        if index < 0 or index >= self.size:
+            raise IndexError("Line %i not in buffer" % index)
+
+        return self.lines[(self.start + index) % self.capacity]
+
+    def __len__(self):
+        return self.size
+
+
+class StatusLog(wx.ListCtrl):
+    """
+    Status log view
+
+    A virtual list control: it only asks for the text of the lines that are
+    actually visible, and those are read from a ring buffer with a fixed size.
+    This keeps adding a message cheap even after hours of scraping. Every
+    message can additionally be written to a log file, so older messages that
+    have dropped out of the buffer are not lost.
+    """
+    log_file = None
+
+    def __init__(self, parent, size, capacity=1000):
+        """
+        Set up log view
+
+        :param parent:  Parent window
+        :param tuple size:  Size of the control
+        :param int capacity:  Amount of lines to keep in the view
+        """
+        wx.ListCtrl.__init__(self, parent, wx.ID_ANY, size=size,
+                             style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_NO_HEADER | wx.LC_SINGLE_SEL | wx.BORDER_NONE)
+        self.InsertColumn(0, "", width=size[0] - wx.SystemSettings.GetMetric(wx.SYS_VSCROLL_X))
+        self.buffer = RingBuffer(capacity)
+
+    def OnGetItemText(self, item, column):
+        """
+        Get text for a visible line
+
+        Called by wx for each line that is drawn.
+
+        :param int item:  Line number
+        :param int column:  Column number, always 0
+        :return str:  Line
+        """
+        try:
+            return self.buffer[item]
+        except IndexError:
+            return ""
+
+    def log(self, message):
+        """
+        Add a message to the log
+
+        Multi-line messages are split into separate lines. The view is scrolled
+        to the newest line.
+
+        :param str message:  Message to add
+        """
+        for line in message.split("\n"):
+            self.buffer.append(line)
+
+        if self.log_file:
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                for line in message.split("\n"):
+                    self.log_file.write("[%s] %s\n" % (timestamp, line))
+            except OSError:
+                # e.g. the disk is full; keep logging in the window only
+                self.stop_log_file()
+                self.buffer.append("Could not write to log file, continuing without it.")
+
+        self.SetItemCount(len(self.buffer))
+        self.RefreshItems(0, len(self.buffer) - 1)
+        self.EnsureVisible(len(self.buffer) - 1)
+
+    def start_log_file(self, path):
+        """
+        Start writing messages to a log file
+
+        Messages are appended, so logs of earlier scrapes to the same file are
+        kept.
+
+        :param Path path:  Path to log file
+        :return bool:  Whether the log file could be opened
+        """
+        self.stop_log_file()
+        try:
+            self.log_file = path.open("a", encoding="utf-8", buffering=1)
+        except (FileNotFoundError, PermissionError):
+            self.log_file = None
+            return False
+
+        return True
+
+    def stop_log_file(self, log_file=None):
+        """
+        Stop writing messages to the log file, if one was being written to
+
+        :param log_file:  Only stop if this file is still the one being
+        written to, rather than one opened for a later scrape
+        """
+        if log_file is not None and log_file is not self.log_file:
+            return
+
+        if self.log_file:
+            try:
+                self.log_file.close()
+            except OSError:
+                pass
+            self.log_file = None
@@ -0,0 +1,91 @@
+import unittest
+
+from dmi_instascraper.budget import Budget, BudgetScheduler
+
+
+class BudgetSchedulerTest(unittest.TestCase):
+    """
+    Division of a budget across queries
+    """
+    def scrape(self, feeds, requests, max_posts=0):
+        """
+        Simulate a budgeted scrape in which every post costs one request
+
+        Like in the scraper, finding out that a feed has run dry also costs
+        a request.
+
+        :param dict feeds:  Amount of posts available per query
+        :param int requests:  Request budget
+        :param int max_posts:  Maximum amount of posts per query
+        :return BudgetScheduler:  Scheduler after the budget has been used
+        """
+        budget = Budget(requests=requests)
+        scheduler = BudgetScheduler(list(feeds), budget, max_posts)
+        remaining = dict(feeds)
+
+        while True:
+            query = scheduler.next_query()
+            if query is None:
+                break
+
+            budget.count_request()
+            if remaining[query]:
+                remaining[query] -= 1
+                scheduler.charge(query, 0, 1, 1)
+            else:
+                scheduler.charge(query, 0, 1)
+                scheduler.retire(query)
+
+        return scheduler
+
+    def test_even_split(self):
+        scheduler = self.scrape({"#a": 100, "#b": 100, "#c": 100}, 30)
+        self.assertEqual(scheduler.posts, {"#a": 10, "#b": 10, "#c": 10})
+        self.assertEqual(scheduler.budget.requests_made, 30)
+
+    def test_dry_feed_leaves_share_to_others(self):
+        scheduler = self.scrape({"#a": 2, "#b": 100, "#c": 100}, 30)
+
+        # 3 requests for #a: 2 posts, and 1 to find there are no more
+        self.assertEqual(scheduler.posts["#a"], 2)
+        self.assertNotIn("#a", scheduler.active)
+        self.assertEqual(scheduler.posts["#b"] + scheduler.posts["#c"], 27)
+        self.assertLessEqual(abs(scheduler.posts["#b"] - scheduler.posts["#c"]), 1)
+
+    def test_max_posts(self):
+        scheduler = self.scrape({"#a": 100, "#b": 100}, 100, max_posts=5)
+        self.assertEqual(scheduler.posts, {"#a": 5, "#b": 5})
+        self.assertEqual(scheduler.active, [])
+
+    def test_expensive_query_waits(self):
+        budget = Budget(requests=100)
+        scheduler = BudgetScheduler(["#slow", "#fast"], budget)
+
+        # a post for #slow took 5 requests, so #fast gets the next turns
+        scheduler.charge("#slow", 0, 5, 1)
+        turns = []
+        for _ in range(5):
+            query = scheduler.next_query()
+            turns.append(query)
+            scheduler.charge(query, 0, 1, 1)
+
+        self.assertEqual(turns, ["#fast"] * 5)
+        self.assertEqual(scheduler.next_query(), "#slow")
+
+    def test_duplicate_queries(self):
+        scheduler = BudgetScheduler(["#a", "#a", "#b"], Budget(requests=10))
+        self.assertEqual(scheduler.active, ["#a", "#b"])
+
+    def test_exhausted(self):
+        budget = Budget(seconds=60, requests=10)
+        scheduler = BudgetScheduler(["#a"], budget)
+        self.assertFalse(budget.exhausted())
+
+        budget.run_out()
+        self.assertTrue(budget.exhausted())
+        self.assertEqual(budget.used(), 1.0)
+        self.assertIsNone(scheduler.next_query())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import tempfile
+import time
+
+from dmi_instascraper.jobs import JobQueue, JOB_OPTIONS
+from pathlib import Path
+
+
+class JobQueueTest(unittest.TestCase):
+    """
+    State transitions of the persistent job queue
+    """
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name).joinpath("jobs.sqlite")
+        self.queue = JobQueue(self.path, max_attempts=2, retry_delay=60)
+
+    def tearDown(self):
+        self.queue.close()
+        self.folder.cleanup()
+
+    def test_claim_order(self):
+        self.queue.add("#low")
+        self.queue.add("#high", priority=1)
+        self.queue.add("#low2")
+
+        self.assertEqual([self.queue.claim()["query"] for _ in range(3)], ["#high", "#low", "#low2"])
+        self.assertIsNone(self.queue.claim())
+
+    def test_options(self):
+        self.queue.add("#tag", options={"max_posts": 10})
+        job = self.queue.claim()
+        self.assertEqual(job["options"], {**JOB_OPTIONS, "max_posts": 10})
+        self.assertEqual(job["attempts"], 1)
+
+        with self.assertRaises(ValueError):
+            self.queue.add("#tag", options={"bogus": True})
+
+    def test_fail_and_retry(self):
+        self.queue.add("#tag")
+
+        # first failure: back in the queue, but not before the retry delay
+        job = self.queue.claim()
+        self.assertTrue(self.queue.fail(job, "error"))
+        self.assertEqual(self.queue.counts()["pending"], 1)
+        self.assertIsNone(self.queue.claim())
+        self.assertGreaterEqual(self.queue.next_retry(), time.time() + 59)
+
+        # second failure: attempts used up
+        self.queue.db.execute("UPDATE jobs SET not_before = 0")
+        job = self.queue.claim()
+        self.assertEqual(job["attempts"], 2)
+        self.queue.fail(job, "error")
+        self.assertEqual(self.queue.counts()["failed"], 1)
+        self.assertIsNone(self.queue.next_retry())
+
+        # queued again with a fresh set of attempts
+        self.assertEqual(self.queue.retry_failed(), 1)
+        job = self.queue.claim()
+        self.assertEqual(job["attempts"], 1)
+        self.assertTrue(self.queue.finish(job, 10, 1.5))
+        self.assertEqual(self.queue.counts(), {"pending": 0, "running": 0, "done": 1, "failed": 0})
+
+    def test_release(self):
+        self.queue.add("#tag")
+        job = self.queue.claim()
+        self.assertTrue(self.queue.release(job))
+
+        job = self.queue.claim()
+        self.assertEqual(job["attempts"], 1)
+
+    def test_recover(self):
+        other = JobQueue(self.path, stale_after=300)
+        other.runner_id = "other-host:1"
+        try:
+            self.queue.add("#tag")
+            job = self.queue.claim()
+
+            # the job has a recent heartbeat, so it is left alone
+            self.assertEqual(other.recover(), 0)
+            self.assertEqual(self.queue.counts()["running"], 1)
+
+            # the heartbeat stopped, so the job is recovered and claimed by
+            # the other runner
+            self.queue.db.execute("UPDATE jobs SET heartbeat = ?", (int(time.time()) - 600,))
+            self.assertEqual(other.recover(), 1)
+            other_job = other.claim()
+            self.assertEqual(other_job["attempts"], 1)
+
+            # the original runner can no longer change the job
+            self.assertFalse(self.queue.owns(job))
+            self.assertFalse(self.queue.finish(job, 10, 1.5))
+            self.assertFalse(self.queue.fail(job, "error"))
+            self.assertFalse(self.queue.release(job))
+
+            self.assertTrue(other.finish(other_job, 5, 1.0))
+            self.assertEqual(self.queue.jobs()[0]["items"], 5)
+        finally:
+            other.close()
+
+    def test_heartbeat(self):
+        self.queue.add("#tag")
+        job = self.queue.claim()
+        self.queue.db.execute("UPDATE jobs SET heartbeat = ?", (int(time.time()) - 600,))
+        self.queue.heartbeat(job)
+        self.assertEqual(self.queue.recover(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+import json
+
+from dmi_instascraper.shards import create_shards, read_manifest, merge, stats_path
+from dmi_instascraper.export import read_csv, write_csv
+from pathlib import Path
+
+
+class ShardTest(unittest.TestCase):
+    """
+    Splitting queries into shards and merging their results
+    """
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_shard(self, name, items, stats):
+        """
+        Write results and statistics as a shard would
+
+        :param str name:  Base file name
+        :param list items:  Items
+        :param dict stats:  Statistics
+        :return Path:  Path to results file
+        """
+        path = self.path.joinpath(name + ".csv")
+        write_csv(path, items)
+        with stats_path(path).open("w", encoding="utf-8") as outfile:
+            json.dump(stats, outfile)
+
+        return path
+
+    def test_split(self):
+        manifests = create_shards(["#a", "#b", "#c", "#a", " "], 2, self.path, {"max_posts": 10})
+
+        self.assertEqual([manifest.name for manifest in manifests],
+                         ["shard-1-of-2.manifest.json", "shard-2-of-2.manifest.json"])
+        first, second = [read_manifest(manifest) for manifest in manifests]
+        self.assertEqual(first["queries"], ["#a", "#c"])
+        self.assertEqual(second["queries"], ["#b"])
+        self.assertEqual(first["options"]["max_posts"], 10)
+
+        with self.assertRaises(ValueError):
+            create_shards(["#a"], 1, self.path, {"bogus": True})
+
+    def test_merge(self):
+        stats = {"shards": 1, "queries": 1, "failed_queries": [], "duration": 10}
+        first = self.write_shard("shard-1-of-2", [
+            {"id": "p1", "type": "picture", "body": "one"},
+            {"id": "c1", "type": "comment", "body": "reply"},
+        ], {**stats, "hosts": ["a"], "started_at": 100, "finished_at": 110})
+
+        # the second shard was scraped with files, so it has an extra column,
+        # and it also found p1
+        second = self.write_shard("shard-2-of-2", [
+            {"id": "p2", "type": "video", "body": "two", "photo_file": "p2.mp4"},
+            {"id": "p1", "type": "picture", "body": "one", "photo_file": "p1.jpg"},
+        ], {**stats, "hosts": ["b"], "failed_queries": ["#x"], "started_at": 90, "finished_at": 105})
+
+        output = self.path.joinpath("merged.csv")
+        result = merge([first, second], output)
+
+        items = list(read_csv(output))
+        self.assertEqual([item["id"] for item in items], ["p1", "c1", "p2"])
+        self.assertEqual(list(items[0].keys()), ["id", "type", "body", "photo_file"])
+        self.assertEqual(items[0]["photo_file"], "")
+        self.assertEqual(items[2]["photo_file"], "p2.mp4")
+
+        self.assertEqual(result["items"], 3)
+        self.assertEqual(result["items_in"], 4)
+        self.assertEqual(result["duplicates"], 1)
+        self.assertEqual((result["posts"], result["comments"]), (2, 1))
+        self.assertEqual(result["shards"], 2)
+        self.assertEqual(result["hosts"], ["a", "b"])
+        self.assertEqual(result["failed_queries"], ["#x"])
+        self.assertEqual((result["started_at"], result["finished_at"]), (90, 110))
+        self.assertEqual(result["duration"], 20)
+
+        with stats_path(output).open(encoding="utf-8") as infile:
+            self.assertEqual(json.load(infile), result)
+
+
+if __name__ == "__main__":
+    unittest.main()